@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+#
+# NOTE
+# * persistent key/value caches stored as json under ~/.config/fy/cache, one
+#   file per cache
+# * set FY_CACHE=false to bypass all caches, only an explicit
+#   `fy env cache --purge` still purges them
+# * writes are atomic and serialized with an exclusive lock so that concurrent
+#   fy processes (e.g: CI jobs on the same runner) can share the caches
+#
+
+import fcntl
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+CACHE_DIR = os.path.join(os.environ["HOME"], ".config/fy/cache")
+
+
+@dataclass
+class Cache:
+    name: str
+    ttl: any = None
+    cache_dir: str = CACHE_DIR
+
+    @property
+    def path(self):
+        return Path(self.cache_dir, f"{self.name}.json")
+
+    @staticmethod
+    def enabled():
+        return os.environ.get("FY_CACHE") != "false"
+
+    def get(self, key):
+        if not self.enabled():
+            return None
+
+        entry = self._load().get(key)
+        if not entry:
+            return None
+
+        if self._expired(entry):
+            return None
+
+        return entry["value"]
+
+    # * expired entries are dropped in the same locked write, as are entries that
+    #   prune(key, value) returns true for, e.g: ones that can never be hit again
+    def set(self, key, value, prune=None):
+        if not self.enabled():
+            return
+
+        with self._lock():
+            entries = {
+                entry_key: entry
+                for entry_key, entry in self._load().items()
+                if not self._expired(entry)
+                and not (prune and prune(entry_key, entry["value"]))
+            }
+            entries[key] = {"value": value, "timestamp": time.time()}
+            self._write(entries)
+
+    def entries(self):
+        return self._load()
+
+    def purge(self, key=None, force=False):
+        if not (self.enabled() or force):
+            return
+
+        with self._lock():
+            if key is None:
+                entries = {}
+            else:
+                entries = self._load()
+                entries.pop(key, None)
+            self._write(entries)
+
+    def _expired(self, entry):
+        return self.ttl is not None and time.time() - entry["timestamp"] > self.ttl
+
+    @contextmanager
+    def _lock(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(Path(self.cache_dir, f".{self.name}.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write(self, entries):
+        write_atomic(self.path, json.dumps(entries, indent=2, sort_keys=True))
+
+
+# write to a temporary file and rename it into place so readers, e.g: concurrent
+# fy processes, never see a partially written file
+def write_atomic(path, content):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w") as file:
+            file.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def caches(cache_dir=CACHE_DIR):
+    return [
+        Cache(path.stem, cache_dir=cache_dir)
+        for path in sorted(Path(cache_dir).glob("*.json"))
+    ]
@@ -3,19 +3,30 @@
 import os
 import shutil
 import sys
+from importlib import import_module
+from itertools import takewhile
 from textwrap import dedent
 
+from . import profile
 from .argparser import ExtendedHelpArgumentParser, UnrecognisedCommandError
-from .dependencies.cli import DependenciesCLI  # noqa: F401
-from .environment.cli import EnvCLI  # noqa: F401
-from .environment.environment import EnvironmentError
-from .infra.cli import InfraCLI  # noqa: F401
-from .kubernetes.cli import K8sCLI  # noqa: F401
-from .module.cli import ModuleCLI  # noqa: F401
-from .skeleton.cli import SkeletonCLI  # noqa: F401
-from .opa.cli import OpaCLI  # noqa: F401
+from .errors import EnvironmentError, ToolNotFoundError
 from .version import __version__
 
+# NOTE
+# * subcommand modules are only imported once the subcommand has been chosen, most
+#   of the start up time of fy is spent importing modules (google-cloud-storage,
+#   rich, jinja2, etc.) that only a single subcommand makes use of
+# * run `make importtime` to report the import time of each subcommand
+COMMANDS = {
+    "env": ("fycli.environment.cli", "EnvCLI"),
+    "skeleton": ("fycli.skeleton.cli", "SkeletonCLI"),
+    "infra": ("fycli.infra.cli", "InfraCLI"),
+    "k8s": ("fycli.kubernetes.cli", "K8sCLI"),
+    "module": ("fycli.module.cli", "ModuleCLI"),
+    "dependencies": ("fycli.dependencies.cli", "DependenciesCLI"),
+    "opa": ("fycli.opa.cli", "OpaCLI"),
+}
+
 
 class DeepArgParser:
     def __init__(self):
@@ -28,12 +39,15 @@ class DeepArgParser:
         ) as error:
             print(f"{error.__class__.__name__}: {error}")
             exit(1)
+        except ToolNotFoundError as error:
+            print(error)
+            exit(127)
 
     def parse_args(self):
         parser = ExtendedHelpArgumentParser(
             usage=dedent(
                 """
-                  fy [--trace] <command> [-h|--help|-v|--version]
+                  fy [--trace] [--profile] <command> [-h|--help|-v|--version]
 
                 commands:
                   env           establish environment from deployment context
@@ -54,35 +68,41 @@ class DeepArgParser:
             parser.print_help()
             exit(1)
 
+        self._set_profile()
         trace = self._set_trace()
 
         args = parser.parse_args(sys.argv[1:2])
         subcommand = args.command
-        class_name = f"{subcommand.capitalize()}CLI"
 
-        # can't use subcommand_exists here since sys.modules has no trace attribute
-        try:
-            if subcommand:
-                getattr(sys.modules[__name__], class_name)
-        except AttributeError:
+        # can't use subcommand_exists here since there is no object to inspect
+        # until the subcommand module has been imported
+        if subcommand not in COMMANDS:
             if not trace:
                 parser.error(f"Command not found: {subcommand}")
-            raise
+            raise UnrecognisedCommandError(f"Command not found: {subcommand}")
 
         # header is useful when using commands with long output, to easily distinguish
         # the start of a new command output
         # header is annoying when using commands with short output when we often want
         # to reference the last commands output
-        if subcommand != "module":
+        # * FY_HEADER=false is set for the fy processes run per app by `fy k8s` and
+        #   per deployment by `fy opa run --all`
+        if subcommand != "module" and os.environ.get("FY_HEADER") != "false":
             self._header()
 
         try:
-            getattr(sys.modules[__name__], class_name)(trace=trace, command=subcommand)
+            with profile.phase(f"import {subcommand}"):
+                command_class = self._load_command(subcommand)
+
+            with profile.phase(f"fy {subcommand}"):
+                command_class(trace=trace, command=subcommand)
         except EnvironmentError as error:
             if not trace:
                 print(f"Error: {error}")
                 exit(1)
             raise
+        finally:
+            profile.report()
 
     def _set_trace(self):
         trace = False
@@ -97,6 +117,18 @@ class DeepArgParser:
 
         return trace
 
+    # like --trace, --profile must come before the command
+    def _set_profile(self):
+        leading_args = list(takewhile(lambda arg: arg.startswith("-"), sys.argv[1:]))
+        if "--profile" in leading_args:
+            profile.enable()
+            sys.argv.pop(sys.argv.index("--profile"))
+
+    @staticmethod
+    def _load_command(subcommand):
+        module_name, class_name = COMMANDS[subcommand]
+        return getattr(import_module(module_name), class_name)
+
     @staticmethod
     def _header():
         columns = shutil.get_terminal_size((80, 20)).columns
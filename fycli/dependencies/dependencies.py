@@ -1,43 +1,39 @@
 #!/usr/bin/env python
 
+import hashlib
 import json
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
 
 import yaml
 from pkg_resources import parse_version
 
-try:
-    from sh import (fy, gcloud, kube_score, kubectl, terraform, tfenv, tfsec,
-                    which, opa)
-except ImportError as error:
-    for command in [
-        "fy",
-        "gcloud",
-        "kube_score",
-        "kubectl",
-        "terraform",
-        "tfsec",
-        "which",
-        "tfenv",
-        "opa"
-    ]:
-        if re.search(r".*'" + command + "'.*", str(error)):
-            print(f"Could not find {command}(1) in path, please install {command}!")
-            exit(127)
+from .. import profile
+from ..cache.cache import Cache
+from ..tools import Tool, which
+from ..version import __version__
+
+gcloud = Tool("gcloud")
+kube_score = Tool("kube_score")
+kubectl = Tool("kubectl")
+opa = Tool("opa")
+terraform = Tool("terraform")
+tfenv = Tool("tfenv")
+tfsec = Tool("tfsec")
 
 
 @dataclass
 class Dependencies:
+    @profile.phase("dependency check")
     def check(self):
         lockfile = self._lockfile()
 
         if not lockfile:
             return
 
-        failed = False
         config = self._load(lockfile)
 
         print(f"==> version checks (lockfile: {lockfile})\n")
@@ -46,21 +42,94 @@ class Dependencies:
             if not version:
                 raise ValueError(f"Invalid version for {exe}: {version}")
 
-            local_version = self._local_version(exe)
+        lockfile_hash = hashlib.sha256(Path(lockfile).read_bytes()).hexdigest()
+
+        # NOTE
+        # * probes are independent and mostly spent waiting on subprocesses, so run
+        #   them concurrently but report results in lockfile order
+        with ThreadPoolExecutor(max_workers=max(len(config), 1)) as executor:
+            probes = {
+                exe: executor.submit(self._cached_local_version, exe, lockfile_hash)
+                for exe in config
+            }
+
+        failures = []
+        for exe, version in config.items():
+            try:
+                local_version = probes[exe].result()
+            except Exception as error:
+                failures.append(f"Could not determine {exe} version: {error}")
+                continue
 
             if parse_version(version) != local_version:
-                print(f"Please change {exe} {local_version} to version {version}")
-                failed = True
+                failures.append(
+                    f"Please change {exe} {local_version} to version {version}"
+                )
             else:
                 print(f"{exe} {local_version}")
 
-        if failed:
+        if failures:
+            print()
+            print(*failures, sep="\n")
             exit(1)
 
+    # NOTE
+    # * binaries rarely change so versions are cached against a fingerprint of the
+    #   executable and lockfile, and only re-probed when the fingerprint changes
+    def _cached_local_version(self, executable, lockfile_hash):
+        cache = Cache("dependencies")
+        fingerprint = self._fingerprint(executable, lockfile_hash)
+
+        cached = cache.get(executable)
+        if fingerprint and cached and cached["fingerprint"] == fingerprint:
+            return parse_version(cached["version"])
+
+        version = self._local_version(executable)
+
+        if fingerprint:
+            cache.set(executable, {"fingerprint": fingerprint, "version": str(version)})
+
+        return version
+
+    def _fingerprint(self, executable, lockfile_hash):
+        # fy version is known in-process, nothing to probe
+        if executable == "fy":
+            return None
+
+        path = which(executable)
+        if not path:
+            return None
+
+        # tfenv selects the terraform version at runtime, e.g: from
+        # .terraform-version, so the shim itself says nothing about the version
+        if executable == "terraform" and self._tfenv_managed(path):
+            return None
+
+        paths = [Path(path).resolve()]
+
+        # gcloud is a wrapper script, components update the sdk VERSION file
+        if executable == "gcloud":
+            paths.append(paths[0].parents[1] / "VERSION")
+
+        stats = []
+        for path in paths:
+            if path.exists():
+                stat = path.stat()
+                stats.append(f"{path}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}")
+
+        return hashlib.sha256(
+            "\n".join([lockfile_hash, *stats]).encode()
+        ).hexdigest()
+
+    @staticmethod
+    def _tfenv_managed(terraform_path):
+        if Path(terraform_path).is_symlink():
+            return "tfenv" in Path(terraform_path).resolve().parts
+        return "tfenv" in Path(terraform_path).parts
+
     def _local_version(self, executable):
         if executable == "fy":
-            output = fy(version=True).stdout.decode("UTF-8").strip()
-            version = self._remove_prefix(output, "fycli ")
+            version = self._remove_prefix(__version__, "fycli ")
 
         elif executable == "gcloud":
             output = json.loads(
@@ -88,11 +157,8 @@ class Dependencies:
             # installed but tfenv is in use then the terraform version check will fail
             # due to stdout being filled with garbage from tfenv during terraform binary
             # install.
-            terraform_path = str(which("terraform"))
-            if Path(terraform_path).is_symlink():
-                if "tfenv" in Path(terraform_path).resolve().parts:
-                    tfenv.install()
-            elif "tfenv" in Path(terraform_path).parts:
+            terraform_path = which("terraform")
+            if terraform_path and self._tfenv_managed(terraform_path):
                 tfenv.install()
 
             output = json.loads(
@@ -1,10 +1,12 @@
 #!/usr/bin/env python
 
+import json
 import sys
 from dataclasses import dataclass, field
 from textwrap import dedent
 
 from ..argparser import ExtendedHelpArgumentParser, subcommand_exists
+from ..cache.cache import Cache, caches
 from .environment import Environment
 
 
@@ -24,6 +26,7 @@ class EnvCLI:
                   pp         pretty print output
                   sh         output in shell sourceable format
                   json       output json format
+                  cache      list or purge cached gcloud and project data
                 """
             ),
         )
@@ -68,3 +71,35 @@ class EnvCLI:
         self.environment = Environment()
 
         print(self.environment.json(args, obfuscate=args.raw))
+
+    def cache(self):
+        parser = ExtendedHelpArgumentParser(
+            usage=dedent(
+                """
+                  fy env cache [-h|--help] [-p|--purge] [-n|--name NAME] [-k|--key KEY]
+                """
+            )
+        )
+        parser.add_argument(
+            "-p", "--purge", help="purge cache entries", action="store_true"
+        )
+        parser.add_argument(
+            "-n", "--name", help="only list or purge the named cache, e.g: project"
+        )
+        parser.add_argument(
+            "-k", "--key", help="only list or purge the given key, e.g: a project id"
+        )
+        args = parser.parse_args(sys.argv[3:])
+
+        selected = [Cache(args.name)] if args.name else caches()
+
+        for cache in selected:
+            if args.purge:
+                cache.purge(args.key, force=True)
+                print(f"purged: {cache.name}{f' {args.key}' if args.key else ''}")
+                continue
+
+            for key, entry in cache.entries().items():
+                if args.key and key != args.key:
+                    continue
+                print(f"{cache.name}: {key} = {json.dumps(entry['value'])}")
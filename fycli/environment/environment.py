@@ -9,27 +9,32 @@
 #   variables from this module at some point..
 #
 
+import hashlib
 import json
 import os
-import re
 import string
 from dataclasses import asdict, dataclass, field
 from pathlib import Path, PurePath
-from sh import kubectl
 
 import yaml
+from sh import ErrorReturnCode
 
-try:
-    from sh import gcloud
-except ImportError as error:
-    for command in ["gcloud"]:
-        if re.search(r".*'" + command + "'.*", str(error)):
-            print(f"Could not find {command}(1) in path, please install {command}!")
-            exit(127)
+from .. import profile
+from ..cache.cache import Cache
+from ..errors import EnvironmentError
+from ..tools import Tool
 
+gcloud = Tool("gcloud")
+kubectl = Tool("kubectl")
 
-class EnvironmentError(Exception):
-    pass
+
+# seconds to trust the cached active gcloud account, the cache key also changes
+# whenever the gcloud configuration changes so this is only a safety net
+GCP_ACCOUNT_CACHE_TTL = 3600
+
+# seconds to reuse cluster credentials written by get-credentials before
+# refreshing them
+KUBE_CREDENTIALS_CACHE_TTL = 12 * 3600
 
 
 @dataclass
@@ -66,11 +71,11 @@ class Environment:
     opa_config: dict = None
 
     # Bare minimum initialization that can be used for most basic operations
+    @profile.phase("environment detection")
     def __post_init__(self):
         self._detect_iac_root()
         self._detect_deployment_type()
         self._configure_deployment_environment()
-        self._set_gcp_account_original()
         self._set_env()
 
     #
@@ -80,6 +85,7 @@ class Environment:
     def initialize_skeleton(self):
         self._set_project_number()
 
+    @profile.phase("environment gcp")
     def initialize_gcp(self):
         self._set_org_id()
         self._set_project_id()
@@ -87,6 +93,12 @@ class Environment:
     def initialize_opa(self):
         self._set_opa_config()
 
+    # NOTE
+    # * gcloud auth list is slow, so only look up the account when it is used
+    def initialize_gcp_account(self):
+        if self.gcp_account_original is None:
+            self._set_gcp_account_original()
+
     #
     # Common environment
     #
@@ -151,21 +163,37 @@ class Environment:
     # Skeleton environment
     #
 
+    # NOTE
+    # * project numbers never change so project metadata is cached indefinitely,
+    #   purge with: fy env cache --purge --name project
     def _set_project_number(self):
-        project_data = json.loads(
-            gcloud.projects.describe(
-                "--format", "json", self.project_id, _env=self.env,
-            ).stdout.decode("UTF-8")
-        )
+        cache = Cache("project")
+
+        project_data = cache.get(self.project_id)
+        if project_data is None:
+            project_data = json.loads(
+                gcloud.projects.describe(
+                    "--format", "json", self.project_id, _env=self.env,
+                ).stdout.decode("UTF-8")
+            )
+            cache.set(self.project_id, project_data)
+
         self.project_number = project_data["projectNumber"]
 
     #
     # GKE
     #
 
-    def activate_container_cluster_context(self):
+    def activate_container_cluster_context(self, reuse_credentials=True):
         print(f"\n==> activate container cluster credentials\n")
 
+        # set by `fy k8s` for each app when run from a cluster directory, the
+        # cluster credentials have already been resolved
+        if os.environ.get("FY_KUBECTL_CONTEXT"):
+            self.kubectl_context = os.environ.get("FY_KUBECTL_CONTEXT")
+            print(f"using context: {self.kubectl_context}")
+            return
+
         # If the user has elected to skip GCloud cluster setup, assume
         # they have already got a context in the environment.
         if os.environ.get("FY_KUBECTL_CONFIGURE") == "false":
@@ -174,19 +202,82 @@ class Environment:
             return
 
         zone = self._detect_cluster_zone()
-        print(
-            gcloud.container.clusters(
-                f"get-credentials",
-                self.k8s_cluster,
-                f"--region={zone}",
-                f"--project={self.project_id}",
-                _err_to_out=True,
-                _env=self.env,
+        context = f"gke_{self.project_id}_{zone}_{self.k8s_cluster}"
+
+        # skip get-credentials when the kubeconfig already holds the context and its
+        # cluster endpoint and CA are unchanged since the last get-credentials, this
+        # is disabled when get-credentials is needed to switch the current-context
+        credentials_cache = Cache("kube_credentials", ttl=KUBE_CREDENTIALS_CACHE_TTL)
+        credentials_key = f"{self._kube_config_path()}:{context}"
+        fingerprint = self._kube_config_context_fingerprint(context)
+        if (
+            reuse_credentials
+            and fingerprint
+            and credentials_cache.get(credentials_key) == fingerprint
+        ):
+            print(f"using existing credentials for context: {context}")
+            self.kubectl_context = context
+            return
+
+        try:
+            print(
+                gcloud.container.clusters(
+                    f"get-credentials",
+                    self.k8s_cluster,
+                    f"--region={zone}",
+                    f"--project={self.project_id}",
+                    _err_to_out=True,
+                    _env=self.env,
+                )
+                .stdout.decode("UTF-8")
+                .rstrip()
             )
-            .stdout.decode("UTF-8")
-            .rstrip()
-        )
-        self.kubectl_context = f"gke_{self.project_id}_{zone}_{self.k8s_cluster}"
+        except ErrorReturnCode:
+            # cached location may be stale, e.g: cluster was recreated elsewhere
+            Cache("cluster_location").purge(self._cluster_location_key())
+            credentials_cache.purge(credentials_key)
+            raise
+        self.kubectl_context = context
+
+        fingerprint = self._kube_config_context_fingerprint(context)
+        if fingerprint:
+            credentials_cache.set(credentials_key, fingerprint)
+
+    # gcloud writes credentials to the first file listed in KUBECONFIG
+    def _kube_config_path(self):
+        return (
+            self.env.get("KUBECONFIG") or os.path.join(os.environ["HOME"], ".kube/config")
+        ).split(os.pathsep)[0]
+
+    def _kube_config_context_fingerprint(self, context_name):
+        kube_config = self._kube_config_path()
+
+        try:
+            with open(kube_config) as file:
+                config = yaml.safe_load(file) or {}
+        except FileNotFoundError:
+            return None
+
+        contexts = {
+            context["name"]: context.get("context") or {}
+            for context in config.get("contexts") or []
+        }
+        clusters = {
+            cluster["name"]: cluster.get("cluster") or {}
+            for cluster in config.get("clusters") or []
+        }
+
+        if context_name not in contexts:
+            return None
+
+        cluster = clusters.get(contexts[context_name].get("cluster"), {})
+        server = cluster.get("server")
+        certificate_authority = cluster.get("certificate-authority-data")
+
+        if not server or not certificate_authority:
+            return None
+
+        return hashlib.sha256(f"{server}\n{certificate_authority}".encode()).hexdigest()
 
     # FIXME
     # * this is shonky and assumes that there wont
@@ -195,41 +286,43 @@ class Environment:
     # * gcp conflates "region" and "zone" which causes this
     #   issue.. it's often referred to as "location" but
     #   is specified with the "--region" flag
+    #
+    # NOTE
+    # * listing clusters without --region returns clusters from all locations, so
+    #   a single call finds both zonal and regional clusters
+    # * the location is cached and purged when get-credentials fails
     def _detect_cluster_zone(self):
-        zones = self._detect_region_zones()
-        zones.append(self.region)
-
-        for zone in zones:
-            data = json.loads(
-                gcloud.container.clusters.list(
-                    f"--region={zone}",
-                    f"--project={self.project_id}",
-                    "--format=json",
-                    _env=self.env,
-                ).stdout.decode("UTF-8")
-            )
-
-            clusters = [
-                cluster for cluster in data if cluster["name"] == self.k8s_cluster
-            ]
+        cache = Cache("cluster_location")
+        key = self._cluster_location_key()
 
-            if clusters:
-                return zone
+        zone = cache.get(key)
+        if zone:
+            return zone
 
-    def _detect_region_zones(self):
-        regions = json.loads(
-            gcloud.compute.zones.list(
-                "--format=json", f"--project={self.project_id}", _env=self.env,
+        data = json.loads(
+            gcloud.container.clusters.list(
+                f"--project={self.project_id}",
+                f"--filter=name={self.k8s_cluster}",
+                "--format=json",
+                _env=self.env,
             ).stdout.decode("UTF-8")
         )
 
-        zones = [
-            region["name"]
-            for region in regions
-            if region["name"].startswith(self.region)
+        locations = [
+            cluster["location"]
+            for cluster in data
+            if cluster["name"] == self.k8s_cluster
+            and cluster["location"].startswith(self.region)
         ]
 
-        return zones
+        if not locations:
+            return None
+
+        cache.set(key, locations[0])
+        return locations[0]
+
+    def _cluster_location_key(self):
+        return f"{self.project_id}/{self.k8s_cluster}"
 
     #
     # GCP environment
@@ -270,6 +363,8 @@ class Environment:
     #
 
     def properties(self, obfuscate):
+        self.initialize_gcp_account()
+
         properties = asdict(self)
 
         populated_properties = {
@@ -333,10 +428,52 @@ class Environment:
         }
 
     def _get_active_gcp_account(self):
+        cache = Cache("gcp_account", ttl=GCP_ACCOUNT_CACHE_TTL)
+        key = self._gcloud_config_fingerprint()
+
+        active = cache.get(key)
+        if active is not None:
+            return active
+
         accounts = json.loads(
             gcloud.auth.list("--format", "json", _env=self.env).stdout.decode("UTF-8")
         )
         active = [
             account["account"] for account in accounts if account["status"] == "ACTIVE"
         ]
+
+        # entries for other gcloud configs are kept, e.g: for concurrent CI jobs with
+        # their own CLOUDSDK_CONFIG, and dropped once they expire
+        cache.set(key, active)
         return active
+
+    # changes whenever the gcloud configuration is altered, e.g: by
+    # `gcloud auth login` or `gcloud config set account`
+    def _gcloud_config_fingerprint(self):
+        gcloud_config_dir = Path(
+            self.env.get("CLOUDSDK_CONFIG")
+            or os.path.join(os.environ["HOME"], ".config/gcloud")
+        )
+        paths = [
+            gcloud_config_dir,
+            gcloud_config_dir / "active_config",
+            gcloud_config_dir / "configurations",
+            gcloud_config_dir / "credentials.db",
+        ]
+        try:
+            active_config = (gcloud_config_dir / "active_config").read_text().strip()
+            paths.append(gcloud_config_dir / "configurations" / f"config_{active_config}")
+        except FileNotFoundError:
+            pass
+
+        mtimes = [
+            f"{path}={path.stat().st_mtime_ns if path.exists() else None}"
+            for path in paths
+        ]
+        cloudsdk_vars = [
+            f"{key}={value}"
+            for key, value in sorted(self.env.items())
+            if key.startswith("CLOUDSDK_")
+        ]
+
+        return hashlib.sha256("\n".join(mtimes + cloudsdk_vars).encode()).hexdigest()
@@ -0,0 +1,13 @@
+#!/usr/bin/env python
+#
+# NOTE
+# * exceptions that `fy` handles at the top level, kept free of dependencies so
+#   dispatching a command doesn't import yaml, sh etc. to be able to catch them
+#
+
+class EnvironmentError(Exception):
+    pass
+
+
+class ToolNotFoundError(Exception):
+    pass
@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 
+import io
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from pathlib import Path
 from textwrap import dedent
@@ -116,7 +119,7 @@ class InfraCLI:
         )
         parser.add_argument(
             "--force-terraform-init",
-            help="force terraform to initialize even if .terraform is already present",
+            help="force terraform to initialize even if nothing changed since last init",
             action="store_true",
         )
         parser.add_argument(
@@ -132,15 +135,32 @@ class InfraCLI:
             help="skip tfsec",
             action="store_true",
         )
+        parser.add_argument(
+            "--save-plan",
+            help="save plan to tfplan.binary/tfplan.json for reuse by fy opa run",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--opa",
+            help="save plan and verify it with OPA rules, implies --save-plan",
+            action="store_true",
+        )
         args = parser.parse_args(sys.argv[3:])
 
         self._setup(args)
 
         try:
             self._terraform_skip_or_init(args)
-            self._terraform_skip_or_validate(args)
-            self._terraform_skip_or_tfsec(args)
-            self._terraform_plan()
+            self._terraform_skip_or_validate_and_tfsec(args)
+            self._terraform_plan(save=args.save_plan or args.opa)
+            if args.opa:
+                # a plan that failed verification must not be applied or left behind
+                try:
+                    self._opa()
+                except BaseException:
+                    self.terraform.remove_plan()
+                    raise
+                print("\napply this plan with: fy infra apply --plan-file tfplan.binary")
         except Exception as error:
             self._handle_error(error, args)
 
@@ -167,7 +187,7 @@ class InfraCLI:
         )
         parser.add_argument(
             "--force-terraform-init",
-            help="force terraform to initialize even if .terraform is already present",
+            help="force terraform to initialize even if nothing changed since last init",
             action="store_true",
         )
         parser.add_argument(
@@ -183,16 +203,29 @@ class InfraCLI:
             help="skip tfsec",
             action="store_true",
         )
+        parser.add_argument(
+            "--opa",
+            help="verify the plan with OPA rules and apply exactly that plan",
+            action="store_true",
+        )
         args = parser.parse_args(sys.argv[3:])
 
         self._setup(args)
 
         try:
             self._terraform_skip_or_init(args)
-            self._terraform_skip_or_validate(args)
-            self._terraform_skip_or_tfsec(args)
-            self._terraform_plan()
-            self._terraform_apply()
+            self._terraform_skip_or_validate_and_tfsec(args)
+            if args.opa:
+                # the saved plan holds sensitive values, never leave it behind
+                try:
+                    self._terraform_plan(save=True)
+                    self._opa()
+                    self._terraform_apply(plan_file="tfplan.binary")
+                finally:
+                    self.terraform.remove_plan()
+            else:
+                self._terraform_plan()
+                self._terraform_apply()
             self._modules_update()
         except Exception as error:
             self._handle_error(error, args)
@@ -218,7 +251,7 @@ class InfraCLI:
         )
         parser.add_argument(
             "--force-terraform-init",
-            help="force terraform to initialize even if .terraform is already present",
+            help="force terraform to initialize even if nothing changed since last init",
             action="store_true",
         )
         parser.add_argument(
@@ -234,15 +267,23 @@ class InfraCLI:
             help="skip tfsec",
             action="store_true",
         )
+        parser.add_argument(
+            "--plan-file",
+            help="apply a saved plan, e.g: from fy infra plan --opa",
+        )
         args = parser.parse_args(sys.argv[3:])
 
         self._setup(args)
 
         try:
             self._terraform_skip_or_init(args)
-            self._terraform_skip_or_validate(args)
-            self._terraform_skip_or_tfsec(args)
-            self._terraform_apply()
+            self._terraform_skip_or_validate_and_tfsec(args)
+            self._terraform_apply(plan_file=args.plan_file)
+            # an applied plan is stale and holds sensitive values
+            if args.plan_file and Path(args.plan_file).resolve() == Path(
+                self.environment.deployment_path, "tfplan.binary"
+            ).resolve():
+                self.terraform.remove_plan()
             self._modules_update()
         except Exception as error:
             self._handle_error(error, args)
@@ -298,7 +339,7 @@ class InfraCLI:
         )
         parser.add_argument(
             "--force-terraform-init",
-            help="force terraform to initialize even if .terraform is already present",
+            help="force terraform to initialize even if nothing changed since last init",
             action="store_true",
         )
         parser.add_argument(
@@ -320,8 +361,7 @@ class InfraCLI:
 
         try:
             self._terraform_skip_or_init(args)
-            self._terraform_skip_or_validate(args)
-            self._tfsec(args)
+            self._terraform_skip_or_validate_and_tfsec(args)
         except Exception as error:
             self._handle_error(error, args)
 
@@ -349,7 +389,7 @@ class InfraCLI:
         )
         parser.add_argument(
             "--force-terraform-init",
-            help="force terraform to initialize even if .terraform is already present",
+            help="force terraform to initialize even if nothing changed since last init",
             action="store_true",
         )
         parser.add_argument(
@@ -369,13 +409,13 @@ class InfraCLI:
             self._handle_error(error, args)
 
     def _terraform_skip_or_init(self, args):
-        # if (
-        #    not args.skip_terraform_init and not self._terraform_initialized()
-        # ) or args.force_terraform_init:
-        #    self._terraform_init()
-        # FIXME: quick fix to always run init
-        if (not args.skip_terraform_init) or args.force_terraform_init:
+        if args.force_terraform_init:
             self._terraform_init()
+        elif not args.skip_terraform_init:
+            if self.terraform.init_required():
+                self._terraform_init()
+            else:
+                print("\n==> terraform init (skipped, no changes since last init)\n")
 
     def _terraform_init(self):
         print("\n==> terraform init\n")
@@ -393,9 +433,12 @@ class InfraCLI:
         if not args.skip_terraform_plan:
             self._terraform_plan()
 
-    def _terraform_plan(self):
+    def _terraform_plan(self, save=False):
         print("\n==> terraform plan\n")
-        self.terraform.plan()
+        if save:
+            self.terraform.plan_out()
+        else:
+            self.terraform.plan()
 
     def _modules_update(self):
         print("\n==> update terraform module data\n")
@@ -405,18 +448,71 @@ class InfraCLI:
         if not args.skip_terraform_apply:
             self._terraform_apply()
 
-    def _terraform_apply(self):
+    def _terraform_apply(self, plan_file=None):
         print("\n==> terraform apply\n")
-        self.terraform.apply()
-
-    def _tfsec(self, args):
+        self.terraform.apply(plan_file=plan_file)
+
+    # verify the saved plan in process, Opa exits non-zero on policy failures
+    # * imported here so only commands that verify with OPA load jinja2 and rules
+    def _opa(self):
+        from ..opa.opa import Opa
+
+        print("\n==> opa\n")
+        Opa(
+            environment=self.environment,
+            terraform=self.terraform,
+            plan_file="tfplan.json",
+        ).run()
+
+    # validate and tfsec are independent of each other so run them as concurrent
+    # stages
+    def _terraform_skip_or_validate_and_tfsec(self, args):
+        stages = []
+        if not args.skip_terraform_validate:
+            stages.append(("terraform validate", self.terraform.validate))
         if not args.skip_tfsec:
-            print("==> tfsec")
-            self.terraform.tfsec()
+            stages.append(("tfsec", self.terraform.tfsec))
+
+        self._run_stages(stages)
+
+    # NOTE
+    # * stages are (name, function) pairs where function accepts an output file
+    # * stages run concurrently with their output buffered, the output is then
+    #   printed in the order the stages were given along with each stage's timing
+    # * the first failure is re-raised once all stage output has been printed
+    def _run_stages(self, stages):
+        if len(stages) == 1:
+            name, function = stages[0]
+            print(f"\n==> {name}\n")
+            function(sys.stdout)
+            return
+
+        with ThreadPoolExecutor(max_workers=max(len(stages), 1)) as executor:
+            results = [
+                (name, executor.submit(self._run_stage, function))
+                for name, function in stages
+            ]
+
+        errors = []
+        for name, result in results:
+            output, duration, error = result.result()
+            print(f"\n==> {name} ({duration:.1f}s)\n")
+            print(output, end="")
+            if error:
+                errors.append(error)
+
+        if errors:
+            raise errors[0]
 
-    def _terraform_skip_or_tfsec(self, args):
-        if not args.skip_tfsec:
-            self._tfsec(args)
+    @staticmethod
+    def _run_stage(function):
+        output = io.StringIO()
+        start = time.monotonic()
+        try:
+            function(output)
+        except BaseException as error:
+            return output.getvalue(), time.monotonic() - start, error
+        return output.getvalue(), time.monotonic() - start, None
 
     def _terraform_skip_or_destroy(self, args):
         if not args.skip_terraform_destroy:
@@ -1,26 +1,27 @@
 #!/usr/bin/env python
 
+import hashlib
 import json
 import os
-import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from pathlib import Path
 from textwrap import dedent
 
 import yaml
+from sh import ErrorReturnCode
 
 from ..argparser import ExtendedHelpArgumentParser, subcommand_exists
+from ..cache.cache import Cache
 from ..dependencies.dependencies import Dependencies
 from ..environment.environment import Environment, EnvironmentError
+from ..tools import Tool
+from .fleet import K8sFleet
 
-try:
-    from sh import kapp, kube_score, kubectl
-except ImportError as error:
-    for command in ["gcloud", "kube-score", "kubectl", "kapp"]:
-        if re.search(r".*'" + command + "'.*", str(error)):
-            print(f"Could not find {command}(1) in path, please install {command}!")
-            exit(127)
+kapp = Tool("kapp")
+kube_score = Tool("kube_score")
+kubectl = Tool("kubectl")
 
 
 @dataclass
@@ -29,6 +30,7 @@ class K8sCLI:
     command: str
     environment: Environment = field(init=False)
     manifest_type: any = field(init=False)
+    manifests: bytes = field(init=False, default=None)
 
     def __post_init__(self):
         parser = ExtendedHelpArgumentParser(
@@ -44,6 +46,9 @@ class K8sCLI:
                   diff       show differences between local and remote config
                   score      run kube-score
                   use        switch kubectl to use current deployment directory context
+
+                plan, apply and diff run every app of the cluster when run from a
+                cluster directory
                 """
             ),
         )
@@ -77,7 +82,40 @@ class K8sCLI:
             except KeyError:
                 pass
 
-        self.environment.activate_container_cluster_context()
+        # `fy k8s use` relies on get-credentials to switch the current-context
+        self.environment.activate_container_cluster_context(
+            reuse_credentials=not disable_gcloud_sandbox
+        )
+
+    def _run_cluster(self, command, args):
+        if not args.skip_version_check:
+            Dependencies().check()
+
+        if not args.skip_environment:
+            print(self.environment.pretty_print(args, obfuscate=True))
+
+        try:
+            self.environment.activate_container_cluster_context()
+
+            # dependencies and environment are checked once rather than per app
+            run_args = ["--skip-version-check", "--skip-environment"]
+            for flag in ["skip_diff", "skip_kube_score", "force"]:
+                if getattr(args, flag, False):
+                    run_args.append(f"--{flag.replace('_', '-')}")
+
+            fleet = K8sFleet(
+                cluster_path=self.environment.deployment_path,
+                jobs=args.parallel,
+                command=command,
+                run_args=run_args,
+                kubectl_context=self.environment.kubectl_context,
+            )
+            passed = fleet.run()
+        except Exception as error:
+            self._handle_error(error)
+
+        if not passed:
+            exit(1)
 
     def _detect_manifest_dir_type(self):
         fy_deployment_config_file = Path(
@@ -142,8 +180,19 @@ class K8sCLI:
         parser.add_argument(
             "--skip-environment", help="skip environment", action="store_true"
         )
+        parser.add_argument(
+            "-p",
+            "--parallel",
+            help="number of apps to run at once from a cluster directory",
+            type=int,
+            default=4,
+        )
         args = parser.parse_args(sys.argv[3:])
 
+        if self.environment.deployment_type == "k8s_cluster":
+            self._run_cluster("diff", args)
+            return
+
         self._setup(args)
 
         try:
@@ -166,8 +215,24 @@ class K8sCLI:
         parser.add_argument(
             "--skip-kube-score", help="skip kube-score", action="store_true"
         )
+        parser.add_argument(
+            "--force",
+            help="apply even if nothing changed since the last apply",
+            action="store_true",
+        )
+        parser.add_argument(
+            "-p",
+            "--parallel",
+            help="number of apps to run at once from a cluster directory",
+            type=int,
+            default=4,
+        )
         args = parser.parse_args(sys.argv[3:])
 
+        if self.environment.deployment_type == "k8s_cluster":
+            self._run_cluster("apply", args)
+            return
+
         try:
             self._setup(args)
 
@@ -175,6 +240,13 @@ class K8sCLI:
                 print("\n==> kube-score\n")
                 self._kube_score()
 
+            if not args.force and self._unchanged_since_last_apply():
+                print(
+                    "\n==> apply skipped, manifests and live objects are unchanged "
+                    "since the last apply (use --force to apply anyway)"
+                )
+                return
+
             kubectl_args = filter(None, [os.environ.get("KUBECTL_CLI_ARGS_APPLY")])
 
             if self.manifest_type == "kubectl":
@@ -182,17 +254,13 @@ class K8sCLI:
                     self._diff()
 
                 print("\n==> kubectl apply\n")
-                print(
-                    kubectl.apply(
-                        *kubectl_args,
-                        "--context",
-                        self.environment.kubectl_context,
-                        "-f",
-                        ".",
-                        _env=self.environment.env,
-                    )
-                    .stdout.decode("UTF-8")
-                    .rstrip()
+                kubectl.apply.stream(
+                    *kubectl_args,
+                    "--context",
+                    self.environment.kubectl_context,
+                    "-f",
+                    ".",
+                    env=self.environment.env,
                 )
 
             elif self.manifest_type == "kustomize":
@@ -200,64 +268,50 @@ class K8sCLI:
                     self._diff()
 
                 print("\n==> kustomize | kubectl apply\n")
-                print(
-                    kubectl.apply(
-                        *kubectl_args,
-                        "--context",
-                        self.environment.kubectl_context,
-                        "-k",
-                        ".",
-                        _env=self.environment.env,
-                    )
-                    .stdout.decode("UTF-8")
-                    .rstrip()
+                kubectl.apply.stream(
+                    *kubectl_args,
+                    "--context",
+                    self.environment.kubectl_context,
+                    "-f",
+                    "-",
+                    input=self._render(),
+                    env=self.environment.env,
                 )
 
             elif self.manifest_type == "kapp":
                 print("\n==> kapp deploy\n")
                 app_name = Path(self.environment.deployment_path).parts[-1]
-                print(
-                    kapp.deploy(
-                        *kubectl_args,
-                        "--diff-changes",
-                        "--kubeconfig-context",
-                        self.environment.kubectl_context,
-                        "-a",
-                        app_name,
-                        "-f",
-                        ".",
-                        "--yes",
-                        _env=self.environment.env,
-                    )
-                    .stdout.decode("UTF-8")
-                    .rstrip()
+                kapp.deploy.stream(
+                    *kubectl_args,
+                    "--diff-changes",
+                    "--kubeconfig-context",
+                    self.environment.kubectl_context,
+                    "-a",
+                    app_name,
+                    "-f",
+                    ".",
+                    "--yes",
+                    env=self.environment.env,
                 )
 
             elif self.manifest_type == "kustomize-kapp":
                 print("\n==> kustomize | kapp deploy\n")
                 app_name = Path(self.environment.deployment_path).parts[-1]
-                print(
-                    kapp.deploy(
-                        kubectl.kustomize(
-                            *kubectl_args,
-                            "--context",
-                            self.environment.kubectl_context,
-                            ".",
-                            _env=self.environment.env,
-                        ),
-                        "--diff-changes",
-                        "--kubeconfig-context",
-                        self.environment.kubectl_context,
-                        "-a",
-                        app_name,
-                        "-f",
-                        "-",
-                        "--yes",
-                        _env=self.environment.env,
-                    )
-                    .stdout.decode("UTF-8")
-                    .rstrip()
+                kapp.deploy.stream(
+                    *kubectl_args,
+                    "--diff-changes",
+                    "--kubeconfig-context",
+                    self.environment.kubectl_context,
+                    "-a",
+                    app_name,
+                    "-f",
+                    "-",
+                    "--yes",
+                    input=self._render(),
+                    env=self.environment.env,
                 )
+
+            self._record_applied_state()
         except Exception as error:
             self._handle_error(error)
 
@@ -276,8 +330,19 @@ class K8sCLI:
         parser.add_argument(
             "--skip-kube-score", help="skip kube-score", action="store_true"
         )
+        parser.add_argument(
+            "-p",
+            "--parallel",
+            help="number of apps to run at once from a cluster directory",
+            type=int,
+            default=4,
+        )
         args = parser.parse_args(sys.argv[3:])
 
+        if self.environment.deployment_type == "k8s_cluster":
+            self._run_cluster("plan", args)
+            return
+
         try:
             self._setup(args)
 
@@ -292,18 +357,14 @@ class K8sCLI:
                     self._diff()
 
                 print("\n==> kubectl apply --dry-run")
-                print(
-                    kubectl.apply(
-                        *kubectl_args,
-                        "--context",
-                        self.environment.kubectl_context,
-                        "--dry-run",
-                        "-f",
-                        ".",
-                        _env=self.environment.env,
-                    )
-                    .stdout.decode("UTF-8")
-                    .rstrip()
+                kubectl.apply.stream(
+                    *kubectl_args,
+                    "--context",
+                    self.environment.kubectl_context,
+                    "--dry-run",
+                    "-f",
+                    ".",
+                    env=self.environment.env,
                 )
 
             elif self.manifest_type == "kustomize":
@@ -311,65 +372,49 @@ class K8sCLI:
                     self._diff()
 
                 print("\n==> kubectl kustomize | kubectl apply --dry-run\n")
-                print(
-                    kubectl.apply(
-                        *kubectl_args,
-                        "--context",
-                        self.environment.kubectl_context,
-                        "--dry-run",
-                        "-k",
-                        ".",
-                        _env=self.environment.env,
-                    )
-                    .stdout.decode("UTF-8")
-                    .rstrip()
+                kubectl.apply.stream(
+                    *kubectl_args,
+                    "--context",
+                    self.environment.kubectl_context,
+                    "--dry-run",
+                    "-f",
+                    "-",
+                    input=self._render(),
+                    env=self.environment.env,
                 )
 
             elif self.manifest_type == "kapp":
                 # NOTE: this is the equiv of plan
                 print("\n==> kapp deploy --diff-run\n")
                 app_name = Path(self.environment.deployment_path).parts[-1]
-                print(
-                    kapp.deploy(
-                        *kubectl_args,
-                        "--diff-run",
-                        "--kubeconfig-context",
-                        self.environment.kubectl_context,
-                        "-a",
-                        app_name,
-                        "-f",
-                        ".",
-                        "--yes",
-                        _env=self.environment.env,
-                    )
-                    .stdout.decode("UTF-8")
-                    .rstrip()
+                kapp.deploy.stream(
+                    *kubectl_args,
+                    "--diff-run",
+                    "--kubeconfig-context",
+                    self.environment.kubectl_context,
+                    "-a",
+                    app_name,
+                    "-f",
+                    ".",
+                    "--yes",
+                    env=self.environment.env,
                 )
 
             elif self.manifest_type == "kustomize-kapp":
                 print("\n==> kustomize | kapp deploy\n")
                 app_name = Path(self.environment.deployment_path).parts[-1]
-                print(
-                    kapp.deploy(
-                        kubectl.kustomize(
-                            *kubectl_args,
-                            "--context",
-                            self.environment.kubectl_context,
-                            ".",
-                            _env=self.environment.env,
-                        ),
-                        "--diff-run",
-                        "--kubeconfig-context",
-                        self.environment.kubectl_context,
-                        "-a",
-                        app_name,
-                        "-f",
-                        "-",
-                        "--yes",
-                        _env=self.environment.env,
-                    )
-                    .stdout.decode("UTF-8")
-                    .rstrip()
+                kapp.deploy.stream(
+                    *kubectl_args,
+                    "--diff-run",
+                    "--kubeconfig-context",
+                    self.environment.kubectl_context,
+                    "-a",
+                    app_name,
+                    "-f",
+                    "-",
+                    "--yes",
+                    input=self._render(),
+                    env=self.environment.env,
                 )
         except Exception as error:
             self._handle_error(error)
@@ -394,50 +439,38 @@ class K8sCLI:
 
             if self.manifest_type == "kubectl":
                 print("\n==> kubectl delete\n")
-                print(
-                    kubectl.delete(
-                        *kubectl_args,
-                        "--context",
-                        self.environment.kubectl_context,
-                        "-f",
-                        ".",
-                        _env=self.environment.env,
-                    )
-                    .stdout.decode("UTF-8")
-                    .rstrip()
+                kubectl.delete.stream(
+                    *kubectl_args,
+                    "--context",
+                    self.environment.kubectl_context,
+                    "-f",
+                    ".",
+                    env=self.environment.env,
                 )
 
             elif self.manifest_type == "kustomize":
                 print("\n==> kustomize | kubectl delete\n")
-                print(
-                    kubectl.delete(
-                        *kubectl_args,
-                        "--context",
-                        self.environment.kubectl_context,
-                        "-k",
-                        ".",
-                        _env=self.environment.env,
-                    )
-                    .stdout.decode("UTF-8")
-                    .rstrip()
+                kubectl.delete.stream(
+                    *kubectl_args,
+                    "--context",
+                    self.environment.kubectl_context,
+                    "-k",
+                    ".",
+                    env=self.environment.env,
                 )
 
             elif self.manifest_type == "kapp" or self.manifest_type == "kustomize-kapp":
                 print("\n==> kapp delete\n")
                 app_name = Path(self.environment.deployment_path).parts[-1]
-                print(
-                    kapp.delete(
-                        *kubectl_args,
-                        "--diff-changes",
-                        "--kubeconfig-context",
-                        self.environment.kubectl_context,
-                        "-a",
-                        app_name,
-                        "--yes",
-                        _env=self.environment.env,
-                    )
-                    .stdout.decode("UTF-8")
-                    .rstrip()
+                kapp.delete.stream(
+                    *kubectl_args,
+                    "--diff-changes",
+                    "--kubeconfig-context",
+                    self.environment.kubectl_context,
+                    "-a",
+                    app_name,
+                    "--yes",
+                    env=self.environment.env,
                 )
         except Exception as error:
             self._handle_error(error)
@@ -450,88 +483,66 @@ class K8sCLI:
 
             if self.manifest_type == "kubectl":
                 print("diff-type: kubectl")
-                changes = (
-                    kubectl.diff(
-                        *kubectl_args,
-                        "--context",
-                        self.environment.kubectl_context,
-                        "-f",
-                        ".",
-                        _env=self.environment.env,
-                        _ok_code=[0, 1],
-                    )
-                    .stdout.decode("UTF-8")
-                    .rstrip()
+                changes = kubectl.diff.stream(
+                    *kubectl_args,
+                    "--context",
+                    self.environment.kubectl_context,
+                    "-f",
+                    ".",
+                    env=self.environment.env,
+                    ok_codes=[0, 1],
                 )
 
             elif self.manifest_type == "kustomize":
                 print("diff-type: kustomize")
-                changes = (
-                    kubectl.diff(
-                        *kubectl_args,
-                        "--context",
-                        self.environment.kubectl_context,
-                        "-k",
-                        ".",
-                        _env=self.environment.env,
-                        _ok_code=[0, 1],
-                    )
-                    .stdout.decode("UTF-8")
-                    .rstrip()
+                changes = kubectl.diff.stream(
+                    *kubectl_args,
+                    "--context",
+                    self.environment.kubectl_context,
+                    "-f",
+                    "-",
+                    input=self._render(),
+                    env=self.environment.env,
+                    ok_codes=[0, 1],
                 )
 
             elif self.manifest_type == "kapp":
                 print("diff-type: kapp")
                 app_name = Path(self.environment.deployment_path).parts[-1]
-                changes = (
-                    kapp.deploy(
-                        *kubectl_args,
-                        "--diff-run",
-                        "--kubeconfig-context",
-                        self.environment.kubectl_context,
-                        "-a",
-                        app_name,
-                        "-f",
-                        ".",
-                        "--yes",
-                        _env=self.environment.env,
-                    )
-                    .stdout.decode("UTF-8")
-                    .rstrip()
+                changes = kapp.deploy.stream(
+                    *kubectl_args,
+                    "--diff-run",
+                    "--kubeconfig-context",
+                    self.environment.kubectl_context,
+                    "-a",
+                    app_name,
+                    "-f",
+                    ".",
+                    "--yes",
+                    env=self.environment.env,
                 )
 
             elif self.manifest_type == "kustomize-kapp":
                 print("diff-type: kustomize-kapp")
                 app_name = Path(self.environment.deployment_path).parts[-1]
-                changes = (
-                    kapp.deploy(
-                        kubectl.kustomize(
-                            *kubectl_args,
-                            "--context",
-                            self.environment.kubectl_context,
-                            ".",
-                            _env=self.environment.env,
-                        ),
-                        "--diff-run",
-                        "--kubeconfig-context",
-                        self.environment.kubectl_context,
-                        "-a",
-                        app_name,
-                        "-f",
-                        "-",
-                        "--yes",
-                        _env=self.environment.env,
-                    )
-                    .stdout.decode("UTF-8")
-                    .rstrip()
+                changes = kapp.deploy.stream(
+                    *kubectl_args,
+                    "--diff-run",
+                    "--kubeconfig-context",
+                    self.environment.kubectl_context,
+                    "-a",
+                    app_name,
+                    "-f",
+                    "-",
+                    "--yes",
+                    input=self._render(),
+                    env=self.environment.env,
                 )
 
         except Exception as error:
             self._handle_error(error)
 
-        if changes:
-            print(changes)
-        else:
+        if not changes:
             print("no changes!")
 
     def score(self):
@@ -553,49 +564,151 @@ class K8sCLI:
                 self.manifest_type == "kustomize"
                 or self.manifest_type == "kustomize-kapp"
             ):
-                kubectl_args = filter(
-                    None,
-                    [os.environ.get("KUBECTL_CLI_ARGS_KUSTOMIZE")],
-                )
                 print(
                     kube_score(
-                        kubectl.kustomize(*kubectl_args),
                         "score",
                         "--kubernetes-version=v1.14",
                         "-v",
                         "-",
+                        _in=self._render(),
                         _ok_code=[0, 1],
                         _env=self.environment.env,
                     ).stdout.decode("UTF-8")
                 )
 
             else:
-                kubectl_args = filter(
-                    None,
-                    [os.environ.get("KUBECTL_CLI_ARGS_KUSTOMIZE")],
-                )
-                for manifest in list(
+                # NOTE
+                # * manifests are scored concurrently but each in its own process,
+                #   so an invalid manifest doesn't hide the results of the others
+                #   and results can be reported per file, in file order
+                manifests = sorted(
                     Path(self.environment.deployment_path).glob("*.yaml")
-                ):
-                    output = kube_score(
-                        "score",
-                        "--kubernetes-version=v1.14",
-                        "-v",
-                        manifest,
-                        _ok_code=[0, 1],
-                        _env=self.environment.env,
-                    ).stdout.decode("UTF-8")
+                )
+                with ThreadPoolExecutor(
+                    max_workers=max(min(len(manifests), os.cpu_count() or 1), 1)
+                ) as executor:
+                    outputs = list(executor.map(self._kube_score_manifest, manifests))
 
+                for manifest, output in zip(manifests, outputs):
                     if output:
+                        print(f"--- {manifest.name}\n")
                         print(output)
         except Exception as error:
             self._handle_error(error)
 
+    def _kube_score_manifest(self, manifest):
+        return kube_score(
+            "score",
+            "--kubernetes-version=v1.14",
+            "-v",
+            manifest,
+            _ok_code=[0, 1],
+            _env=self.environment.env,
+        ).stdout.decode("UTF-8")
+
+    # NOTE
+    # * an apply is skipped when neither the manifests nor the live objects changed
+    #   since the last successful apply to the same context, objects changed or
+    #   deleted outside of fy change their uid and generation (or resourceVersion
+    #   for objects without a generation, e.g: configmaps)
+    # * generation rather than resourceVersion since controllers keep updating the
+    #   status of e.g: deployments after the apply, which only bumps the latter
+    # * state is only recorded when all objects can be read back with kubectl,
+    #   e.g: not for kapp apps that include kapp config
+    def _unchanged_since_last_apply(self):
+        last_applied = Cache("k8s_apply").get(self._applied_state_key())
+        return last_applied is not None and last_applied == self._applied_state()
+
+    def _applied_state(self):
+        resource_versions = self._live_resource_versions()
+        if resource_versions is None:
+            return None
+        return {
+            "manifests": self._manifests_hash(),
+            "resource_versions": resource_versions,
+        }
+
+    def _record_applied_state(self):
+        applied = self._applied_state()
+        if applied:
+            Cache("k8s_apply").set(self._applied_state_key(), applied)
+
+    def _applied_state_key(self):
+        return f"{self.environment.kubectl_context}:{self.environment.deployment_path}"
+
+    def _manifests_hash(self):
+        digest = hashlib.sha256(
+            f"{self.manifest_type}:{os.environ.get('KUBECTL_CLI_ARGS_APPLY')}".encode()
+        )
+
+        if self.manifest_type in ["kustomize", "kustomize-kapp"]:
+            digest.update(self._render())
+        else:
+            deployment_path = Path(self.environment.deployment_path)
+            for path in sorted(deployment_path.rglob("*")):
+                if path.is_file():
+                    digest.update(str(path.relative_to(deployment_path)).encode())
+                    digest.update(path.read_bytes())
+
+        return digest.hexdigest()
+
+    def _live_resource_versions(self):
+        if self.manifest_type in ["kustomize", "kustomize-kapp"]:
+            source = {"_in": self._render()}
+            files = ["-f", "-"]
+        elif self.manifest_type == "kapp":
+            source = {}
+            files = ["-f", ".", "--recursive"]
+        else:
+            source = {}
+            files = ["-f", "."]
+
+        try:
+            live = json.loads(
+                kubectl.get(
+                    *files,
+                    "--context",
+                    self.environment.kubectl_context,
+                    "-o",
+                    "json",
+                    _env=self.environment.env,
+                    **source,
+                ).stdout.decode("UTF-8")
+            )
+        except (ErrorReturnCode, ValueError):
+            return None
+
+        objects = live.get("items", []) if live.get("kind") == "List" else [live]
+        resource_versions = sorted(
+            f"{item['kind']}/{item['metadata'].get('namespace', '')}/"
+            f"{item['metadata']['name']}={self._object_version(item['metadata'])}"
+            for item in objects
+        )
+        return hashlib.sha256("\n".join(resource_versions).encode()).hexdigest()
+
+    @staticmethod
+    def _object_version(metadata):
+        if "generation" in metadata:
+            return f"{metadata['uid']}:{metadata['generation']}"
+        return metadata["resourceVersion"]
+
+    # NOTE
+    # * kustomize overlays are rendered once per run and the same manifests are
+    #   scored, diffed and applied, so what was reviewed is exactly what is applied
+    def _render(self):
+        if self.manifests is None:
+            kubectl_args = filter(None, [os.environ.get("KUBECTL_CLI_ARGS_KUSTOMIZE")])
+            self.manifests = kubectl.kustomize(
+                *kubectl_args, ".", _env=self.environment.env
+            ).stdout
+        return self.manifests
+
     def _client_email(self):
         with open(self.environment.google_application_credentials, "r") as file:
             return json.load(file)["client_email"]
 
     def _gcp_account_active(self):
+        self.environment.initialize_gcp_account()
         return self.environment.gcp_account_original
 
     def _handle_error(self, error):
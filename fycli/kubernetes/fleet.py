@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+#
+# NOTE
+# * runs a `fy k8s` command for every app of a cluster with at most `jobs` apps
+#   running concurrently, each app runs in its own process since the environment
+#   is tied to the working directory
+# * apps run in the order given by kubernetes.cluster.order in the cluster's
+#   .fy.yaml.skip, each entry is an app or a list of apps that don't depend on
+#   each other, apps that are not listed run last and apps after a failure are
+#   skipped, e.g:
+#
+#     kubernetes:
+#       cluster:
+#         order:
+#           - cert-manager
+#           - [ingress-nginx, external-dns]
+#
+# * cluster credentials are resolved once up front and passed on to each app
+#   through FY_KUBECTL_CONTEXT
+# * app output is streamed line by line prefixed with the app name, only the
+#   last lines are kept to report failures
+#
+
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import yaml
+
+from .. import profile
+from ..environment.environment import EnvironmentError
+from ..tools import STREAM_TAIL_LINES
+
+CLUSTER_CONFIG_FILE = ".fy.yaml.skip"
+
+
+@dataclass
+class K8sFleet:
+    cluster_path: str
+    jobs: int
+    command: str
+    run_args: list
+    kubectl_context: str
+    print_lock: any = field(init=False, default_factory=threading.Lock)
+
+    def apps(self):
+        return sorted(
+            path.name
+            for path in Path(self.cluster_path).iterdir()
+            if path.is_dir()
+            and not path.name.startswith(".")
+            and (
+                any(path.glob("*.yaml")) or Path(path, CLUSTER_CONFIG_FILE).exists()
+            )
+        )
+
+    def stages(self):
+        apps = self.apps()
+
+        stages = []
+        for entry in self._order():
+            stage = [entry] if isinstance(entry, str) else list(entry)
+            unknown = [app for app in stage if app not in apps]
+            if unknown:
+                raise EnvironmentError(
+                    f"unknown apps in {CLUSTER_CONFIG_FILE} kubernetes.cluster.order: "
+                    f"{', '.join(unknown)}"
+                )
+            stages.append(stage)
+
+        ordered = {app for stage in stages for app in stage}
+        remaining = [app for app in apps if app not in ordered]
+        if remaining:
+            stages.append(remaining)
+
+        return stages
+
+    def run(self):
+        stages = self.stages()
+        print(
+            f"\n==> k8s {self.command}: {sum(len(stage) for stage in stages)} apps, "
+            f"{len(stages)} stages, {self.jobs} jobs"
+        )
+
+        results = []
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for stage in stages:
+                if any(result["status"] != "passed" for result in results):
+                    results.extend(
+                        {"app": app, "status": "skipped", "duration": 0.0}
+                        for app in stage
+                    )
+                    continue
+
+                futures = [executor.submit(self._run_app, app) for app in stage]
+                results.extend(future.result() for future in futures)
+
+        for result in results:
+            if result["status"] == "FAILED":
+                print(f"\n==> {result['app']} (last output)\n")
+                print(result["output"].rstrip())
+
+        print("\n==> summary\n")
+        for result in sorted(results, key=lambda result: result["app"]):
+            print(f"{result['status']:<7} {result['duration']:>7.1f}s  {result['app']}")
+
+        passed = [result for result in results if result["status"] == "passed"]
+        print(f"\n--- {len(passed)}/{len(results)} apps passed ---")
+
+        return len(passed) == len(results)
+
+    def _order(self):
+        config_file = Path(self.cluster_path, CLUSTER_CONFIG_FILE)
+        if not config_file.exists():
+            return []
+
+        with open(config_file) as file:
+            config = yaml.safe_load(file) or {}
+
+        return ((config.get("kubernetes") or {}).get("cluster") or {}).get(
+            "order"
+        ) or []
+
+    def _run_app(self, app):
+        app_path = Path(self.cluster_path, app)
+
+        tail = deque(maxlen=STREAM_TAIL_LINES)
+
+        start = time.monotonic()
+        with profile.phase(str(app_path), "deployment"), profile.child() as (
+            profile_args,
+            profile_env,
+        ):
+            process = subprocess.Popen(
+                [sys.executable, "-m", "fycli", *profile_args, "k8s", self.command]
+                + self.run_args,
+                cwd=app_path,
+                env={
+                    **os.environ,
+                    **profile_env,
+                    "PWD": str(app_path),
+                    "FY_KUBECTL_CONTEXT": self.kubectl_context,
+                    "FY_HEADER": "false",
+                },
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                errors="replace",
+            )
+            try:
+                for line in process.stdout:
+                    line = line.rstrip("\n")
+                    tail.append(line)
+                    with self.print_lock:
+                        print(f"[{app}] {line}", flush=True)
+            finally:
+                process.stdout.close()
+                process.wait()
+
+        status = "passed" if process.returncode == 0 else "FAILED"
+        with self.print_lock:
+            print(f"[{app}] ==> {status}", flush=True)
+
+        return {
+            "app": app,
+            "status": status,
+            "duration": round(time.monotonic() - start, 3),
+            "output": "\n".join(tail),
+        }
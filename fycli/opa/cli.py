@@ -1,15 +1,19 @@
 #!/usr/bin/env python
 
+import os
 import sys
 from dataclasses import dataclass, field
-from textwrap import dedent
 from pathlib import Path
+from textwrap import dedent
+
+import yaml
 
 from ..argparser import ExtendedHelpArgumentParser, subcommand_exists
 from ..dependencies.dependencies import Dependencies
 from ..environment.environment import Environment, EnvironmentError
 from ..skeleton.skeleton import Skeleton
 from ..terraform.terraform import Terraform
+from .fleet import OpaFleet
 from .opa import Opa
 
 
@@ -28,6 +32,8 @@ class OpaCLI:
 
                 commands:
                   run      Run OPA verification
+                  build    Build an OPA bundle from the rendered rules
+                  rules    List rules files, or dump the effective merged rules
                 """
             ),
         )
@@ -38,11 +44,14 @@ class OpaCLI:
 
         subcommand_exists(self, parser, subcommand)
 
+        getattr(self, subcommand)()
+
+    # NOTE
+    # * not done up front since `fy opa run --all` runs outside of a deployment
+    def _init_environment(self):
         self.environment = Environment()
         self.environment.initialize_gcp()
 
-        getattr(self, subcommand)()
-
     def _setup(self, args):
         if not args.skip_version_check:
             Dependencies().check()
@@ -62,8 +71,9 @@ class OpaCLI:
             skeleton.apply()
 
         self.terraform = Terraform(environment=self.environment)
-        terraform_initialized = Path(".terraform").exists()
-        if (not args.skip_terraform_init) or args.force_terraform_init:
+        if args.force_terraform_init or (
+            not args.skip_terraform_init and self.terraform.init_required()
+        ):
             print("\n==> terraform init\n")
             self.terraform.init()
 
@@ -88,19 +98,174 @@ class OpaCLI:
         )
         parser.add_argument(
             "--force-terraform-init",
-            help="force terraform to initialize even if .terraform is already present",
+            help="force terraform to initialize even if nothing changed since last init",
+            action="store_true",
+        )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            help="evaluate rule packages separately, running up to JOBS at once",
+            type=int,
+            default=1,
+        )
+        parser.add_argument(
+            "-b",
+            "--bundle",
+            help="evaluate against a (cached) OPA bundle instead of rego files",
+            action="store_true",
+        )
+        parser.add_argument(
+            "-O",
+            "--optimize",
+            help="bundle optimization level, implies --bundle",
+            type=int,
+            default=0,
+        )
+        parser.add_argument(
+            "--plan-file",
+            help="evaluate an existing plan (binary or json) instead of planning",
+        )
+        parser.add_argument(
+            "--force-plan",
+            help="plan even if a saved plan with unchanged inputs exists",
             action="store_true",
         )
+        parser.add_argument(
+            "--all",
+            help="verify every infra deployment under the IAC root",
+            action="store_true",
+        )
+        parser.add_argument(
+            "-p",
+            "--parallel",
+            help="number of deployments to verify at once with --all",
+            type=int,
+            default=os.cpu_count() or 1,
+        )
+        parser.add_argument("--report", help="write a json report, with --all")
+        parser.add_argument("--junit", help="write a junit xml report, with --all")
         args = parser.parse_args(sys.argv[3:])
 
+        if args.all:
+            if args.plan_file:
+                parser.error("--plan-file can not be used with --all")
+            self._run_all(args)
+            return
+
+        self._init_environment()
         self._setup(args)
 
         try:
-            self.opa = Opa(environment=self.environment, terraform=self.terraform)
+            self.opa = Opa(
+                environment=self.environment,
+                terraform=self.terraform,
+                jobs=args.jobs,
+                use_bundle=args.bundle or args.optimize > 0,
+                optimize=args.optimize,
+                plan_file=args.plan_file,
+                force_plan=args.force_plan,
+            )
             self.opa.run()
         except Exception as error:
             self._handle_error(error, args)
 
+    def _run_all(self, args):
+        if not args.skip_version_check:
+            Dependencies().check()
+
+        # dependencies are checked once rather than per deployment
+        run_args = [
+            "--skip-version-check",
+            f"--jobs={args.jobs}",
+            f"--optimize={args.optimize}",
+        ]
+        for flag in [
+            "skip_environment",
+            "skip_skeleton",
+            "force_skeleton",
+            "skip_terraform_init",
+            "force_terraform_init",
+            "bundle",
+            "force_plan",
+        ]:
+            if getattr(args, flag):
+                run_args.append(f"--{flag.replace('_', '-')}")
+
+        try:
+            fleet = OpaFleet(
+                iac_root=self._iac_root(), jobs=args.parallel, run_args=run_args
+            )
+            passed = fleet.run(report=args.report, junit=args.junit)
+        except Exception as error:
+            self._handle_error(error, args)
+
+        if not passed:
+            exit(1)
+
+    @staticmethod
+    def _iac_root():
+        if os.environ.get("FY_IAC_ROOT"):
+            return os.environ.get("FY_IAC_ROOT")
+
+        pwd = Path(os.environ.get("PWD"))
+        for path in [pwd, *pwd.parents]:
+            if Path(path, "deployment").exists() and Path(path, ".fy.lock").exists():
+                return str(path)
+
+        raise EnvironmentError(
+            "unable to determine IAC root dir, please set FY_IAC_ROOT or re-run "
+            "from a sub-directory of the IAC directory"
+        )
+
+    def build(self):
+        parser = ExtendedHelpArgumentParser(usage="\n  fy opa build [-h|--help]")
+        parser.add_argument(
+            "-O",
+            "--optimize",
+            help="bundle optimization level",
+            type=int,
+            default=0,
+        )
+        args = parser.parse_args(sys.argv[3:])
+
+        self._init_environment()
+
+        if self.environment.deployment_type != "infra":
+            raise EnvironmentError("is this an 'infra' deployment directory?")
+
+        try:
+            print("\n==> opa build\n")
+            self.opa = Opa(
+                environment=self.environment,
+                terraform=Terraform(environment=self.environment),
+                optimize=args.optimize,
+            )
+            self.opa.build()
+        except Exception as error:
+            self._handle_error(error, args)
+
+    def rules(self):
+        parser = ExtendedHelpArgumentParser(usage="\n  fy opa rules [-h|--help|--dump]")
+        parser.add_argument(
+            "--dump", help="print the effective merged rules", action="store_true"
+        )
+        args = parser.parse_args(sys.argv[3:])
+
+        self._init_environment()
+
+        try:
+            self.opa = Opa(
+                environment=self.environment,
+                terraform=Terraform(environment=self.environment),
+            )
+
+            if args.dump:
+                print(yaml.safe_dump(self.opa.merged_rules(), sort_keys=False).rstrip())
+            else:
+                print(*self.opa.rules_files(), sep="\n")
+        except Exception as error:
+            self._handle_error(error, args)
+
     def _handle_error(self, error, args):
         print("\n==> exception caught!")
         print("\n==> stack trace\n")
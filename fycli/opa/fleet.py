@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+#
+# NOTE
+# * runs `fy opa run` for every infra deployment under the IAC root with at most
+#   `jobs` deployments running concurrently
+# * each deployment runs in its own process since the environment and terraform
+#   are tied to the working directory, rendered rules and bundles are shared
+#   between deployments through the content addressed caches in ~/.config/fy
+#
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from .. import profile
+
+
+@dataclass
+class OpaFleet:
+    iac_root: str
+    jobs: int
+    run_args: list
+    print_lock: any = field(init=False, default_factory=threading.Lock)
+
+    def deployments(self):
+        return sorted(Path(self.iac_root, "deployment").glob("*/*/*/infra"))
+
+    def run(self, report=None, junit=None):
+        deployments = self.deployments()
+        print(f"\n==> opa run: {len(deployments)} deployments, {self.jobs} jobs\n")
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            results = list(executor.map(self._run_deployment, deployments))
+
+        failures = [result for result in results if not result["passed"]]
+        for result in failures:
+            print(f"\n==> {result['deployment']}\n")
+            print(result["output"].rstrip())
+
+        print("\n==> summary\n")
+        for result in results:
+            print(self._status_line(result))
+
+        print(f"\n--- {len(results) - len(failures)}/{len(results)} deployments passed ---")
+
+        if report:
+            with open(report, "w") as file:
+                json.dump(results, file, indent=2)
+            print(f"report: {report}")
+
+        if junit:
+            self._write_junit(results, junit)
+            print(f"junit report: {junit}")
+
+        return not failures
+
+    def _run_deployment(self, deployment_path):
+        start = time.monotonic()
+        with profile.phase(str(deployment_path), "deployment"), profile.child() as (
+            profile_args,
+            profile_env,
+        ):
+            process = subprocess.run(
+                [sys.executable, "-m", "fycli", *profile_args, "opa", "run"]
+                + self.run_args,
+                cwd=deployment_path,
+                env={
+                    **os.environ,
+                    **profile_env,
+                    "PWD": str(deployment_path),
+                    "FY_HEADER": "false",
+                },
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+            )
+
+        result = {
+            "deployment": str(Path(deployment_path).relative_to(self.iac_root)),
+            "passed": process.returncode == 0,
+            "returncode": process.returncode,
+            "duration": round(time.monotonic() - start, 3),
+            "output": process.stdout,
+        }
+
+        # progress, the full output of failed deployments is printed at the end
+        with self.print_lock:
+            print(self._status_line(result), flush=True)
+
+        return result
+
+    @staticmethod
+    def _status_line(result):
+        status = "passed" if result["passed"] else "FAILED"
+        return f"{status:<7} {result['duration']:>7.1f}s  {result['deployment']}"
+
+    @staticmethod
+    def _write_junit(results, junit):
+        testsuite = ElementTree.Element(
+            "testsuite",
+            name="fy opa",
+            tests=str(len(results)),
+            failures=str(len([result for result in results if not result["passed"]])),
+            time=str(round(sum(result["duration"] for result in results), 3)),
+        )
+
+        for result in results:
+            testcase = ElementTree.SubElement(
+                testsuite,
+                "testcase",
+                classname="fy.opa",
+                name=result["deployment"],
+                time=str(result["duration"]),
+            )
+            if not result["passed"]:
+                failure = ElementTree.SubElement(
+                    testcase,
+                    "failure",
+                    message=f"OPA verification failed (exit {result['returncode']})",
+                )
+                failure.text = result["output"]
+            ElementTree.SubElement(testcase, "system-out").text = result["output"]
+
+        ElementTree.ElementTree(testsuite).write(
+            junit, encoding="UTF-8", xml_declaration=True
+        )
@@ -1,21 +1,52 @@
 #!/usr/bin/env python
 
+import copy
+import hashlib
 import json
 import os
+import re
+import shlex
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
 import yaml
 from jinja2 import Environment as JinjaEnv, FileSystemLoader
+from .. import profile
+from ..cache.cache import Cache, write_atomic
 from ..environment.environment import Environment
-from ..terraform.terraform import Terraform
+from ..terraform.json_filter import filter_json_file
+from ..terraform.terraform import PLAN_INPUTS_SUFFIX, Terraform
 from subprocess import check_output, CalledProcessError
 
+# use the libyaml (C) loader when pyyaml has been built with it
+try:
+    from yaml import CFullLoader as YamlLoader
+except ImportError:
+    from yaml import FullLoader as YamlLoader
+
+# pruned plan document passed to opa as input
+OPA_INPUT_FILE = "tfplan-opa.json"
+
+# top level input fields referenced by rules, e.g: input.resource_changes
+INPUT_KEY_PATTERN = re.compile(r"\binput\.([A-Za-z_][A-Za-z0-9_]*)")
+# input referenced as a whole, e.g: input[key] or `import input`
+INPUT_WHOLE_PATTERN = re.compile(r"\binput\b(?!\.)")
+
 
 @dataclass
 class Opa:
     environment: Environment
     terraform: Terraform
     rego_file: dict = field(init=False)
+    jobs: int = 1
+    use_bundle: bool = False
+    optimize: int = 0
+    bundle: any = field(init=False, default=None)
+    plan_file: any = None
+    force_plan: bool = False
+    plan_json: str = field(init=False, default="tfplan.json")
+    created_files: list = field(init=False, default_factory=list)
 
     def __post_init__(self):
         self.environment.initialize_gcp()
@@ -24,19 +55,13 @@ class Opa:
     def run(self):
         rules = self._get_ruleset()
         self.rego_files = self._generate_rego_files(rules)
+        if self.use_bundle:
+            print("\n==> opa build\n")
+            self.bundle = self._build_bundle()
         print("\n==> terraform plan\n")
-        self.terraform.plan_out()
-        response = True
+        self._plan()
         print("\n==> opa run\n")
-        for key, filename in self.rego_files.items():
-            package_name = key.replace("-", "_")
-            output = self._exec(f"opa eval -i tfplan.json -d {filename} --fail-defined 'data.{package_name}.success'")
-            if not output:
-                response = False
-                error_output = self._exec(f"opa eval -i tfplan.json -d {filename} 'data.{package_name}.deny'")
-                error = json.loads(error_output)
-                print("--- OPA validation errors ---\n")
-                print(*error['result'][0]['expressions'][0]['value'], sep="\n")
+        response = self._evaluate()
 
         self.cleanup()
         if not response:
@@ -44,10 +69,160 @@ class Opa:
         else:
             print("--- OPA verification complete ---")
 
+    # NOTE
+    # * by default all packages are evaluated by a single `opa eval` so that
+    #   tfplan.json is only parsed once, the query returns the whole data document
+    #   from which each package's success and deny rules are read
+    # * for rule sets too large to combine, jobs > 1 evaluates each package in its
+    #   own `opa eval` with at most `jobs` running concurrently, results are
+    #   reported in rule order, this doesn't apply to bundles which are already
+    #   compiled as a whole
+    # * as with the previous `--fail-defined` check, a package fails when its
+    #   success rule is defined
+    def _evaluate(self):
+        if self.jobs > 1 and not self.bundle:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                evaluations = list(
+                    zip(
+                        self.rego_files,
+                        executor.map(
+                            lambda filename: self._eval_data([filename]),
+                            self.rego_files.values(),
+                        ),
+                    )
+                )
+        else:
+            data = self._eval_data(list(self.rego_files.values()))
+            if data is None:
+                print("--- OPA evaluation failed ---\n")
+                return False
+            evaluations = [(key, data) for key in self.rego_files]
+
+        response = True
+        for key, data in evaluations:
+            if data is None:
+                response = False
+                print(f"--- OPA evaluation failed: {key} ---\n")
+                continue
+
+            package = data
+            for name in key.replace("-", "_").split("."):
+                package = package.get(name, {})
+
+            if "success" in package:
+                response = False
+                print("--- OPA validation errors ---\n")
+                print(*package.get("deny", []), sep="\n")
+
+        return response
+
+    def _eval_data(self, filenames):
+        if self.bundle:
+            data_files = f"-b {shlex.quote(str(self.bundle))}"
+        else:
+            data_files = " ".join(
+                f"-d {shlex.quote(filename)}" for filename in filenames
+            )
+        output = self._exec(
+            f"opa eval -i {shlex.quote(self.plan_json)} {data_files} --format json data"
+        )
+        if not output:
+            return None
+
+        result = json.loads(output).get("result", [{}])[0]
+        return result.get("expressions", [{}])[0].get("value", {})
+
+    def build(self):
+        rules = self._get_ruleset()
+        self.rego_files = self._generate_rego_files(rules)
+        return self._build_bundle()
+
+    # NOTE
+    # * compiles the rendered rego files into a bundle so that policies are not
+    #   parsed and compiled again by every `opa eval`
+    # * bundles are cached under ~/.config/fy/opa-cache/bundles keyed by the
+    #   (content addressed) rego files and optimization level
+    # * optimized bundles use each rule package as an entrypoint
+    def _build_bundle(self):
+        key = hashlib.sha256(
+            "\n".join(
+                [f"optimize={self.optimize}", *sorted(self.rego_files.values())]
+            ).encode()
+        ).hexdigest()
+        bundle = Path(self.environment.config_dir, "opa-cache", "bundles", f"{key}.tar.gz")
+
+        if bundle.exists():
+            print(f"bundle: {bundle} (cached)")
+            return bundle
+
+        bundle.parent.mkdir(parents=True, exist_ok=True)
+        tmp_bundle = bundle.parent / f".{bundle.name}.{os.getpid()}"
+
+        command = [
+            "opa build",
+            f"-o {shlex.quote(str(tmp_bundle))}",
+            *[shlex.quote(filename) for filename in self.rego_files.values()],
+        ]
+        if self.optimize:
+            command.append(f"-O={self.optimize}")
+            command.extend(
+                f"-e {key.replace('-', '_').replace('.', '/')}"
+                for key in self.rego_files
+            )
+
+        if self._exec(" ".join(command)) is False:
+            print("--- OPA bundle build failed ---")
+            exit(1)
+
+        os.replace(tmp_bundle, bundle)
+        print(f"bundle: {bundle}")
+        return bundle
+
+    # NOTE
+    # * re-planning a large project is slow, so reuse either the given plan file or
+    #   a saved plan (e.g: from `fy infra plan --save-plan`) whose inputs match
+    # * the plan is pruned to the top level fields the rules reference, which cuts
+    #   the size of the document opa has to load
+    # * only plan files created here are removed by cleanup
+    def _plan(self):
+        input_keys = self._input_keys()
+
+        if self.plan_file and not self.plan_file.endswith(".json"):
+            print(f"using plan: {self.plan_file}")
+            self.plan_json = OPA_INPUT_FILE
+            self.terraform.show_json(self.plan_file, self.plan_json, keys=input_keys)
+            self.created_files.append(self.plan_json)
+            return
+
+        if self.plan_file:
+            print(f"using plan: {self.plan_file}")
+            self.plan_json = self.plan_file
+        elif not self.force_plan and self.terraform.plan_reusable():
+            print("using saved plan: tfplan.binary (inputs unchanged)")
+        else:
+            self.terraform.plan_out()
+            self.created_files.extend(
+                ["tfplan.binary", "tfplan.json", f"tfplan{PLAN_INPUTS_SUFFIX}"]
+            )
+
+        if input_keys:
+            filter_json_file(self.plan_json, OPA_INPUT_FILE, input_keys)
+            self.plan_json = OPA_INPUT_FILE
+            self.created_files.append(OPA_INPUT_FILE)
+
+    # returns None when rules reference the input as a whole, or not at all, in
+    # which case the plan is passed to opa unpruned
+    def _input_keys(self):
+        keys = set()
+        for filename in self.rego_files.values():
+            source = Path(filename).read_text()
+            if INPUT_WHOLE_PATTERN.search(source):
+                return None
+            keys.update(INPUT_KEY_PATTERN.findall(source))
+        return keys or None
+
     def cleanup(self):
-        self._delete_file(os.path.join(self.environment.deployment_path,'tfplan.binary'))
-        self._delete_file(os.path.join(self.environment.deployment_path, 'tfplan.json'))
-        for key, filename in self.rego_files.items():
+        for filename in self.created_files:
             self._delete_file(os.path.join(self.environment.deployment_path, filename))
 
     def _delete_file(self, filepath):
@@ -59,20 +234,43 @@ class Opa:
         except:
             print("Error while deleting file ", filepath)
 
+    # NOTE
+    # * rendered rego files are cached under ~/.config/fy/opa-cache keyed by the
+    #   template sources and the rule values, so unchanged rules are never
+    #   re-rendered and nothing is written to the deployment directory
+    # * all templates are part of the key since templates can include each other
+    # * the cache directory can safely be deleted at any time
     def _generate_rego_files(self, rules):
         template_dir = os.path.join(self.environment.iac_root_dir, self.environment.opa_config["template_dir"])
-        file_loader = FileSystemLoader(template_dir)
-        env = JinjaEnv(loader=file_loader)
+        templates_hash = self._templates_hash(template_dir)
+        env = None
         rego_files = {}
         for rule in rules:
-            template = env.get_template(f"{rule}.rego.j2")
-            output = template.render(opa_rules=rules[rule])
-            rego_files[rule] = f"{rule}.rego"
-            with open(rego_files[rule], "w") as file:
-                file.write(output)
+            key = hashlib.sha256(
+                "\n".join(
+                    [templates_hash, rule, json.dumps(rules[rule], sort_keys=True)]
+                ).encode()
+            ).hexdigest()
+            rego_file = Path(self.environment.config_dir, "opa-cache", key, f"{rule}.rego")
+
+            if not rego_file.exists():
+                if env is None:
+                    env = JinjaEnv(loader=FileSystemLoader(template_dir))
+                template = env.get_template(f"{rule}.rego.j2")
+                write_atomic(rego_file, template.render(opa_rules=rules[rule]))
+
+            rego_files[rule] = str(rego_file)
 
         return rego_files
 
+    @staticmethod
+    def _templates_hash(template_dir):
+        digest = hashlib.sha256()
+        for template in sorted(Path(template_dir).rglob("*.j2")):
+            digest.update(str(template.relative_to(template_dir)).encode())
+            digest.update(template.read_bytes())
+        return digest.hexdigest()
+
     # Updates folders with a list of paths containing a rules yaml ruleset
     def _find_opa_file_parent(self, path: Path,
                               dirs,
@@ -85,18 +283,49 @@ class Opa:
             self._find_opa_file_parent(path.parent, dirs)
 
     def _get_ruleset(self):
+        rules = copy.deepcopy(self.merged_rules())
+        rules = self._process_value(rules)
+        return rules
+
+    def rules_files(self):
         dirs = []
         self._find_opa_file_parent(Path.cwd(), dirs)
+        return dirs[::-1]
+
+    # NOTE
+    # * merged rules are cached keyed on the path, mtime and size of every rules
+    #   file, so parent rules files shared by many deployments are parsed once
+    # * entries for rules files that have since changed are pruned when a new
+    #   entry is added, so the cache doesn't grow with every edit
+    # * within a process each rules file is also only parsed once
+    def merged_rules(self):
+        rules_files = [
+            _rules_file_signature(rules_file) for rules_file in self.rules_files()
+        ]
+        key = hashlib.sha256(json.dumps(rules_files).encode()).hexdigest()
+
+        cache = Cache("opa_rules")
+        entry = cache.get(key)
+        if entry is not None and "rules" in entry:
+            return entry["rules"]
+
         rules = {}
-        for f in dirs[::-1]:
-            with open(f) as file:
-                content = yaml.load(file, Loader=yaml.FullLoader)
-                if not rules:
-                    rules = content
-                else:
-                    rules = self._merge(rules, content)
+        for rules_file in rules_files:
+            content = copy.deepcopy(_load_rules_file(*rules_file))
+            if not rules:
+                rules = content
+            else:
+                rules = self._merge(rules, content)
+
+        # only cache rules that survive a round trip through json unchanged, e.g:
+        # yaml dates or non-string keys do not
+        if json.loads(json.dumps(rules, default=str)) == rules:
+            cache.set(
+                key,
+                {"files": rules_files, "rules": rules},
+                prune=lambda _, entry: _rules_files_changed(entry),
+            )
 
-        rules = self._process_value(rules)
         return rules
 
     def _merge(self, a, b, path=None):
@@ -126,7 +355,32 @@ class Opa:
 
     def _exec(self, command):
         try:
-            out = check_output(command, shell=True, universal_newlines=True)
+            with profile.phase(profile.command_name(command), "subprocess"):
+                out = check_output(command, shell=True, universal_newlines=True)
             return out
         except CalledProcessError:
             return False
+
+
+def _rules_file_signature(rules_file):
+    stat = Path(rules_file).stat()
+    return [str(rules_file), stat.st_mtime_ns, stat.st_size]
+
+
+def _rules_files_changed(entry):
+    if not isinstance(entry, dict) or "files" not in entry:
+        return True
+
+    try:
+        return any(
+            _rules_file_signature(path) != [path, mtime, size]
+            for path, mtime, size in entry["files"]
+        )
+    except FileNotFoundError:
+        return True
+
+
+@lru_cache(maxsize=None)
+def _load_rules_file(path, mtime, size):
+    with open(path) as file:
+        return yaml.load(file, Loader=YamlLoader)
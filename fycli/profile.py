@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+#
+# NOTE
+# * enabled with `fy --profile <command>`, records how long each phase and
+#   subprocess takes, then prints a summary table and writes the events in
+#   chrome trace format (load in chrome://tracing or https://ui.perfetto.dev)
+# * the trace file defaults to ~/.config/fy/profile/<timestamp>-<pid>.json and
+#   can be set with FY_PROFILE_FILE
+# * phases are no-ops when profiling is disabled, `phase` can be used as a
+#   context manager or a decorator
+# * child fy processes, e.g: `fy opa run --all` per deployment, are profiled too
+#   and their events are merged into the parent's trace, see: child
+#
+
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+PROFILE_DIR = os.path.join(os.environ["HOME"], ".config/fy/profile")
+
+_enabled = False
+_events = []
+_lock = threading.Lock()
+_start = time.perf_counter()
+_start_time = time.time()
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def enabled():
+    return _enabled
+
+
+@contextmanager
+def phase(name, category="fy"):
+    if not _enabled:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        with _lock:
+            _events.append(
+                {
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": round((start - _start) * 1e6),
+                    "dur": round((end - start) * 1e6),
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                }
+            )
+
+
+# yields the extra args and environment to profile a child fy process, e.g:
+#   with profile.child() as (profile_args, profile_env):
+#       subprocess.run(["fy", *profile_args, "opa", "run"], env={**profile_env})
+@contextmanager
+def child():
+    if not _enabled:
+        yield [], {}
+        return
+
+    fd, trace_file = tempfile.mkstemp(prefix="fy-profile-", suffix=".json")
+    os.close(fd)
+    try:
+        yield ["--profile"], {"FY_PROFILE_FILE": trace_file}
+        _merge(trace_file)
+    finally:
+        os.remove(trace_file)
+
+
+def _merge(trace_file):
+    try:
+        with open(trace_file) as file:
+            trace = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return
+
+    # child timestamps are relative to the child's own start
+    offset = round((trace["otherData"]["start_time"] - _start_time) * 1e6)
+    with _lock:
+        _events.extend(
+            {**event, "ts": event["ts"] + offset} for event in trace["traceEvents"]
+        )
+
+
+# e.g: "terraform plan -out=tfplan" -> "terraform plan"
+def command_name(command):
+    return " ".join(command.split()[:2])
+
+
+def report():
+    if not _enabled:
+        return
+
+    print("\n==> profile\n")
+
+    totals = defaultdict(lambda: [0, 0.0])
+    for event in _events:
+        totals[(event["cat"], event["name"])][0] += 1
+        totals[(event["cat"], event["name"])][1] += event["dur"] / 1e6
+
+    rows = sorted(totals.items(), key=lambda item: item[1][1], reverse=True)
+    width = max([len(name) for (_, name), _ in rows] + [5])
+
+    print(f"{'phase'.ljust(width)}  {'category':<10} {'count':>5} {'seconds':>9}")
+    for (category, name), (count, seconds) in rows:
+        print(f"{name.ljust(width)}  {category:<10} {count:>5} {seconds:>9.3f}")
+    print(f"\ntotal: {time.perf_counter() - _start:.3f}s")
+
+    trace_file = os.environ.get("FY_PROFILE_FILE") or os.path.join(
+        PROFILE_DIR, f"{int(time.time())}-{os.getpid()}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(trace_file)), exist_ok=True)
+    with open(trace_file, "w") as file:
+        json.dump(
+            {
+                "traceEvents": _events,
+                "displayTimeUnit": "ms",
+                "otherData": {"start_time": _start_time},
+            },
+            file,
+        )
+    print(f"trace: {trace_file}")
@@ -6,6 +6,7 @@ from dataclasses import dataclass, field
 from pathlib import Path, PurePath
 import shutil
 
+from .. import profile
 from ..environment.environment import Environment
 
 
@@ -21,6 +22,7 @@ class Skeleton:
         self._set_skeleton_path()
         self._set_files()
 
+    @profile.phase("skeleton apply")
     def apply(self):
         self._generate_boilerplate_files()
 
@@ -46,6 +48,7 @@ class Skeleton:
             ".terraform.lock.hcl",
         )
 
+    @profile.phase("skeleton clean")
     def clean(self):
         files = list(Path(".").glob("_*"))
 
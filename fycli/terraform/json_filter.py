@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+#
+# NOTE
+# * streams a json object and writes out only the requested top level keys, e.g:
+#   to prune a `terraform show -json` plan down to what OPA rules reference
+# * values are copied verbatim rather than parsed, so memory use is bounded by the
+#   chunk size no matter how large the document is
+#
+
+import json
+import re
+from dataclasses import dataclass, field
+
+CHUNK_SIZE = 1024 * 1024
+
+# characters that matter outside and inside of strings, everything in between
+# is skipped or copied in bulk
+VALUE_TOKENS = re.compile(r'[{}\[\]",]')
+STRING_TOKENS = re.compile(r'["\\]')
+KEY_TOKENS = re.compile(r'["}]')
+
+
+class JsonFilterError(Exception):
+    pass
+
+
+@dataclass
+class JsonKeyFilter:
+    keys: set
+    output: any
+
+    state: str = field(init=False, default="start")
+    key: list = field(init=False, default_factory=list)
+    key_escape: bool = field(init=False, default=False)
+    keep: bool = field(init=False, default=False)
+    depth: int = field(init=False, default=0)
+    in_string: bool = field(init=False, default=False)
+    escape: bool = field(init=False, default=False)
+    written: int = field(init=False, default=0)
+
+    def feed(self, chunk):
+        pos = 0
+        while pos < len(chunk):
+            if self.state == "start":
+                pos = self._expect(chunk, pos, "{", "key")
+                if self.state == "key":
+                    self.output.write("{")
+
+            elif self.state == "key":
+                match = KEY_TOKENS.search(chunk, pos)
+                if not match:
+                    return
+                if match.group() == "}":
+                    self.state = "done"
+                    return
+                self.key = ['"']
+                self.state = "key_string"
+                pos = match.end()
+
+            elif self.state == "key_string":
+                pos = self._feed_key(chunk, pos)
+
+            elif self.state == "colon":
+                pos = self._expect(chunk, pos, ":", "value")
+
+            elif self.state == "value":
+                pos = self._feed_value(chunk, pos)
+
+            else:
+                return
+
+    def close(self):
+        if self.state != "done":
+            raise JsonFilterError(
+                f"unexpected end of json document in state: {self.state}"
+            )
+        self.output.write("}\n")
+
+    def _expect(self, chunk, pos, char, next_state):
+        stripped = len(chunk) - len(chunk[pos:].lstrip())
+        if stripped >= len(chunk):
+            return len(chunk)
+        if chunk[stripped] != char:
+            raise JsonFilterError(f"expected '{char}' but found '{chunk[stripped]}'")
+        self.state = next_state
+        return stripped + 1
+
+    def _feed_key(self, chunk, pos):
+        while pos < len(chunk):
+            char = chunk[pos]
+            self.key.append(char)
+            pos += 1
+            if self.key_escape:
+                self.key_escape = False
+            elif char == "\\":
+                self.key_escape = True
+            elif char == '"':
+                raw_key = "".join(self.key)
+                self.keep = json.loads(raw_key) in self.keys
+                if self.keep:
+                    if self.written:
+                        self.output.write(",")
+                    self.output.write(f"{raw_key}:")
+                    self.written += 1
+                self.depth = 0
+                self.state = "colon"
+                break
+        return pos
+
+    # a value ends at the first ',' or '}' outside of any string or container
+    def _feed_value(self, chunk, pos):
+        start = pos
+        while pos < len(chunk):
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                    pos += 1
+                    continue
+                match = STRING_TOKENS.search(chunk, pos)
+                if not match:
+                    pos = len(chunk)
+                    break
+                if match.group() == "\\":
+                    self.escape = True
+                else:
+                    self.in_string = False
+                pos = match.end()
+                continue
+
+            match = VALUE_TOKENS.search(chunk, pos)
+            if not match:
+                pos = len(chunk)
+                break
+
+            token = match.group()
+            if token == '"':
+                self.in_string = True
+            elif token in "{[":
+                self.depth += 1
+            elif self.depth > 0 and token in "}]":
+                self.depth -= 1
+            elif self.depth == 0 and token in ",}":
+                self._write_value(chunk[start : match.start()])
+                self.state = "key" if token == "," else "done"
+                return match.end()
+            pos = match.end()
+
+        self._write_value(chunk[start:pos])
+        return pos
+
+    def _write_value(self, text):
+        if self.keep:
+            self.output.write(text)
+
+
+def filter_json_stream(stream, output, keys):
+    json_filter = JsonKeyFilter(keys=set(keys), output=output)
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), ""):
+        json_filter.feed(chunk)
+    json_filter.close()
+
+
+def filter_json_file(source, destination, keys):
+    with open(source) as stream, open(destination, "w") as output:
+        filter_json_stream(stream, output, keys)
@@ -1,23 +1,35 @@
 #!/usr/bin/env python
 
+import hashlib
+import json
 import os
 import re
 import sys
 from dataclasses import dataclass
 from pathlib import Path
-from subprocess import Popen
+from subprocess import PIPE, Popen
 
 from google.cloud import storage
 
+from .. import profile
 from ..environment.environment import Environment
+from ..tools import CommandError, Tool, resolve, stream
+from .json_filter import filter_json_stream
 
-try:
-    from sh import tfsec
-except ImportError as error:
-    for command in ["tfsec"]:
-        if re.search(r".*'" + command + "'.*", str(error)):
-            print(f"could not find {command}(1) in path, please install {command}!")
-            exit(127)
+terraform = Tool("terraform")
+tfsec = Tool("tfsec")
+
+# records the inputs of the last successful init, see: Terraform.init_required
+INIT_FINGERPRINT_FILE = ".terraform/fy-init.sha256"
+
+# records the inputs of a saved plan, see: Terraform.plan_reusable
+PLAN_INPUTS_SUFFIX = ".inputs.sha256"
+
+# module and provider source/version arguments, changing these requires an init
+INIT_SOURCE_PATTERN = re.compile(r"^\s*(source|version)\s*=")
+
+# local module sources, e.g: source = "./modules/x"
+LOCAL_SOURCE_PATTERN = re.compile(r'^\s*source\s*=\s*"(\.\.?/[^"]*)"', re.MULTILINE)
 
 
 @dataclass
@@ -25,14 +37,7 @@ class Terraform:
     environment: Environment
 
     def init(self):
-        bucket = "".join(
-            [
-                f"{self.environment.org_id}-terraform-state-",
-                f"{self.environment.region}",
-                f"-{self.environment.environment}",
-                f"-{self.environment.deployment}",
-            ]
-        )
+        bucket = self._state_bucket()
 
         command = "".join(
             [
@@ -44,6 +49,85 @@ class Terraform:
         print(f"state: gs://{bucket}/terraform.state\n")
         self._exec(command)
 
+        Path(self.environment.deployment_path, INIT_FINGERPRINT_FILE).write_text(
+            self._init_fingerprint()
+        )
+
+    # NOTE
+    # * init is only required when the backend config, provider lock file, module
+    #   or provider sources, or terraform version differ from the last init
+    def init_required(self):
+        try:
+            fingerprint = Path(
+                self.environment.deployment_path, INIT_FINGERPRINT_FILE
+            ).read_text()
+        except FileNotFoundError:
+            return True
+
+        return fingerprint != self._init_fingerprint()
+
+    def _init_fingerprint(self):
+        deployment_path = Path(self.environment.deployment_path)
+
+        version = self._terraform_version()
+
+        lockfile = deployment_path / ".terraform.lock.hcl"
+        lockfile_hash = (
+            hashlib.sha256(lockfile.read_bytes()).hexdigest()
+            if lockfile.exists()
+            else None
+        )
+
+        inputs = [
+            f"backend=gs://{self._state_bucket()}/terraform.state",
+            f"terraform={version}",
+            f"lockfile={lockfile_hash}",
+        ]
+
+        for module_dir in self._module_dirs():
+            for tf_file in sorted(module_dir.glob("*.tf")):
+                name = os.path.relpath(tf_file, deployment_path)
+                for line in tf_file.read_text().splitlines():
+                    if INIT_SOURCE_PATTERN.match(line):
+                        inputs.append(f"{name}:{line.strip()}")
+
+        return hashlib.sha256("\n".join(inputs).encode()).hexdigest()
+
+    # NOTE
+    # * the root and every module dir, modules installed by init are listed in
+    #   modules.json, local modules that aren't installed yet are found by following
+    #   local sources from the root
+    def _module_dirs(self):
+        deployment_path = Path(self.environment.deployment_path).resolve()
+        module_dirs = {deployment_path}
+
+        modules_file = deployment_path / ".terraform/modules/modules.json"
+        if modules_file.exists():
+            for module in json.loads(modules_file.read_text()).get("Modules", []):
+                module_dirs.add((deployment_path / module["Dir"]).resolve())
+
+        pending = list(module_dirs)
+        while pending:
+            module_dir = pending.pop()
+            for tf_file in module_dir.glob("*.tf"):
+                for source in LOCAL_SOURCE_PATTERN.findall(tf_file.read_text()):
+                    local_dir = (module_dir / source).resolve()
+                    if local_dir.is_dir() and local_dir not in module_dirs:
+                        module_dirs.add(local_dir)
+                        pending.append(local_dir)
+
+        return sorted(module_dirs)
+
+    def _state_bucket(self):
+        return "".join(
+            [
+                f"{self.environment.org_id}-terraform-state-",
+                f"{self.environment.region}",
+                f"-{self.environment.environment}",
+                f"-{self.environment.deployment}",
+            ]
+        )
+
     def modules_update(self):
         cwd = os.environ["PWD"]
         modules_file = Path(cwd, ".terraform/modules/modules.json")
@@ -68,8 +152,8 @@ class Terraform:
             print(f"File not found: {modules_file}")
             print(f"Please generate modules file by running an apply")
 
-    def validate(self):
-        self._exec("terraform validate")
+    def validate(self, output=None):
+        self._exec("terraform validate", output=output)
 
     def plan(self):
         if os.environ.get("TERRAFORM_CLI_ARGS_PLAN"):
@@ -78,19 +162,153 @@ class Terraform:
             self._exec("terraform plan")
 
     def plan_out(self, filename="tfplan"):
+        # record the inputs before planning so that anything changed while the plan
+        # runs invalidates it
+        inputs_hash = self.plan_inputs_hash()
+
         if os.environ.get("TERRAFORM_CLI_ARGS_PLAN"):
             self._exec(f"terraform plan --out {filename}.binary {os.environ.get('TERRAFORM_CLI_ARGS_PLAN')}")
         else:
             self._exec(f"terraform plan --out {filename}.binary")
-        self._exec(f"terraform show -json {filename}.binary > {filename}.json")
+        self.show_json(f"{filename}.binary", f"{filename}.json")
+
+        Path(
+            self.environment.deployment_path, f"{filename}{PLAN_INPUTS_SUFFIX}"
+        ).write_text(inputs_hash)
+
+    # * when keys are given only those top level keys are kept, the output of
+    #   terraform show is filtered as it streams so the full document is never
+    #   held in memory or written to disk
+    def show_json(self, plan_file, json_file, keys=None):
+        if not keys:
+            self._exec(f"terraform show -json {plan_file} > {json_file}")
+            return
+
+        with profile.phase("terraform show", "subprocess"):
+            process = Popen(
+                [resolve("terraform"), "show", "-json", plan_file],
+                stdout=PIPE,
+                env=self.environment.env,
+                text=True,
+            )
+            try:
+                with open(json_file, "w") as output:
+                    filter_json_stream(process.stdout, output, keys)
+            except BaseException:
+                # terraform would block forever on a full pipe nobody reads
+                process.kill()
+                raise
+            finally:
+                process.stdout.close()
+                process.wait()
+
+        if process.returncode != 0:
+            exit(process.returncode)
+
+    # NOTE
+    # * a saved plan can be reused while its inputs are unchanged: tf files, tfvars,
+    #   lock file, module sources, TF_VAR_* and plan args, terraform version and the
+    #   remote state generation
+    def plan_reusable(self, filename="tfplan"):
+        inputs_file = Path(
+            self.environment.deployment_path, f"{filename}{PLAN_INPUTS_SUFFIX}"
+        )
+        plan_files = [
+            Path(self.environment.deployment_path, f"{filename}.binary"),
+            Path(self.environment.deployment_path, f"{filename}.json"),
+            inputs_file,
+        ]
+
+        if not all(plan_file.exists() for plan_file in plan_files):
+            return False
+
+        return inputs_file.read_text() == self.plan_inputs_hash()
+
+    def plan_inputs_hash(self):
+        deployment_path = Path(self.environment.deployment_path)
+        digest = hashlib.sha256()
+
+        config_files = sorted(
+            [
+                *deployment_path.glob("*.tf"),
+                *deployment_path.glob("*.tfvars"),
+                *deployment_path.glob("*.tfvars.json"),
+                deployment_path / ".terraform.lock.hcl",
+            ]
+        )
+
+        for module_dir in self._module_dirs():
+            if module_dir != deployment_path.resolve():
+                config_files.extend(sorted(module_dir.glob("*.tf")))
+
+        for config_file in config_files:
+            if config_file.exists():
+                digest.update(str(config_file).encode())
+                digest.update(config_file.read_bytes())
+
+        # variables and cli args given through the environment change the plan too
+        env = self.environment.env
+        plan_env = sorted(
+            f"{key}={value}"
+            for key, value in env.items()
+            if key.startswith("TF_VAR_")
+            or key in ["TF_CLI_ARGS", "TF_CLI_ARGS_plan", "TF_WORKSPACE"]
+        )
+        digest.update("\n".join(plan_env).encode())
+        digest.update(os.environ.get("TERRAFORM_CLI_ARGS_PLAN", "").encode())
+        digest.update(self._terraform_version().encode())
+        digest.update(str(self._state_generation()).encode())
+
+        return digest.hexdigest()
+
+    def _terraform_version(self):
+        return json.loads(
+            terraform.version(json=True, _env=self.environment.env)
+            .stdout.decode("UTF-8")
+            .strip()
+        )["terraform_version"]
+
+    # NOTE
+    # * the state object's generation changes on every write, reading its metadata
+    #   is much cheaper than pulling the whole state
+    def _state_generation(self):
+        workspace = self.environment.env.get("TF_WORKSPACE")
+        if not workspace:
+            workspace_file = Path(
+                self.environment.deployment_path, ".terraform/environment"
+            )
+            workspace = (
+                workspace_file.read_text().strip()
+                if workspace_file.exists()
+                else "default"
+            )
+
+        blob = (
+            storage.Client(project=self.environment.project_id)
+            .bucket(self._state_bucket())
+            .get_blob(f"terraform.state/{workspace}.tfstate")
+        )
+        if blob is None:
+            return None
+        return f"{blob.generation}:{blob.metageneration}"
 
     # FIXME
     # * probably replace this with --terraform-args argument?
-    def apply(self):
+    # * when a saved plan file is given exactly that plan is applied, without
+    #   refreshing or prompting
+    def apply(self, plan_file=None):
+        command = ["terraform apply"]
         if os.environ.get("TERRAFORM_CLI_ARGS_APPLY"):
-            self._exec(f"terraform apply {os.environ.get('TERRAFORM_CLI_ARGS_APPLY')}")
-        else:
-            self._exec("terraform apply")
+            command.append(os.environ.get("TERRAFORM_CLI_ARGS_APPLY"))
+        if plan_file:
+            command.append(plan_file)
+        self._exec(" ".join(command))
+
+    def remove_plan(self, filename="tfplan"):
+        for suffix in [".binary", ".json", PLAN_INPUTS_SUFFIX]:
+            Path(self.environment.deployment_path, f"{filename}{suffix}").unlink(
+                missing_ok=True
+            )
 
     def destroy(self):
         if os.environ.get("TERRAFORM_CLI_ARGS_DESTROY"):
@@ -100,40 +318,32 @@ class Terraform:
         else:
             self._exec("terraform destroy")
 
-    def tfsec(self):
+    def tfsec(self, output=None):
         # * ignore GCP002 error about unencrypted buckets since buckets are
         #   encrypted by default, see: https://github.com/liamg/tfsec/issues/137
-        output = (
+        report = (
             tfsec(".", "--exclude=GCP002", _ok_code=[0, 1, 2])
                 .stdout.decode("UTF-8")
                 .rstrip()
         )
 
         # trim this pointless output when no problems detected: '0 potential problems detected:'
-        if output.find("No problems detected!") == -1:
-            print(output)
+        if report.find("No problems detected!") == -1:
+            print(report, file=output or sys.stdout)
         else:
-            print("\nNo problems detected!")
+            print("\nNo problems detected!", file=output or sys.stdout)
 
     # NOTE
     # * using popen to try to fix github action output ordering..
     # * this can probably be changed back to use 'sh' since execution
     #    is now wrapped in script(1)
-    def _exec(self, command):
-        process = Popen(
-            command,
-            shell=True,
-            stdout=sys.stdout,
-            stderr=sys.stderr,
-            env=self.environment.env,
-            text=True,
-            bufsize=1,
-            universal_newlines=True,
-        )
-        out, err = process.communicate()
-
-        if process.returncode != 0:
-            exit(process.returncode)
+    # * pass output to buffer stdout and stderr instead, e.g: for stages that
+    #   run concurrently
+    def _exec(self, command, output=None):
+        try:
+            stream(command, env=self.environment.env, output=output, shell=True)
+        except CommandError as error:
+            exit(error.returncode)
 
     def _upload_blob(
             self, project_id, bucket_name, source_file_name, destination_blob_name
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+#
+# NOTE
+# * tools are looked up in PATH on first use rather than at import time, so a
+#   missing tool is only reported by commands that actually need it
+# * lookups are cached for the lifetime of the process
+# * `stream` runs a command printing its output as it arrives, for commands
+#   with long running or large output, e.g: kapp deploy, terraform apply
+#
+
+import codecs
+import os
+import shlex
+import shutil
+import sys
+import threading
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+from subprocess import PIPE, STDOUT, Popen
+
+import sh
+
+from . import profile
+from .errors import ToolNotFoundError
+
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_TAIL_LINES = 100
+
+
+class CommandError(Exception):
+    def __init__(self, command, returncode, tail):
+        self.command = command
+        self.returncode = returncode
+        self.tail = tail
+        super().__init__(
+            f"'{command}' exited with status {returncode}, last output:\n\n{tail}"
+        )
+
+
+@lru_cache(maxsize=None)
+def which(name):
+    # python identifiers can't contain dashes, e.g: kube_score -> kube-score
+    for candidate in dict.fromkeys([name, name.replace("_", "-")]):
+        path = shutil.which(candidate)
+        if path:
+            return path
+    return None
+
+
+def resolve(name):
+    path = which(name)
+    if not path:
+        tool = name.replace("_", "-")
+        raise ToolNotFoundError(
+            f"Could not find {tool}(1) in path, please install {tool}!"
+        )
+    return path
+
+
+@lru_cache(maxsize=None)
+def command(name):
+    return sh.Command(resolve(name))
+
+
+# NOTE
+# * output is written to `output` (default stdout) in chunks as it arrives rather
+#   than buffered until the process exits, so prompts and progress show up
+#   immediately, only the last lines are kept for the error so memory is bounded
+# * stderr is merged into stdout to keep the two in order
+# * returns the number of characters written, e.g: to tell if a diff is empty
+def stream(args, env=None, input=None, output=None, ok_codes=(0,), shell=False):
+    output = output or sys.stdout
+    command_line = (
+        args if shell else shlex.join([os.path.basename(args[0]), *args[1:]])
+    )
+
+    with profile.phase(profile.command_name(command_line), "subprocess"):
+        process = Popen(
+            args,
+            shell=shell,
+            env=env,
+            stdin=PIPE if input is not None else None,
+            stdout=PIPE,
+            stderr=STDOUT,
+        )
+
+        # written from a thread so a process that writes before it has read all
+        # of its input can't deadlock
+        if input is not None:
+            threading.Thread(
+                target=_write_input, args=(process.stdin, input), daemon=True
+            ).start()
+
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        tail = deque(maxlen=STREAM_TAIL_LINES)
+        line = ""
+        written = 0
+        try:
+            for chunk in iter(lambda: process.stdout.read1(STREAM_CHUNK_SIZE), b""):
+                text = decoder.decode(chunk)
+                output.write(text)
+                output.flush()
+                written += len(text)
+
+                lines = (line + text).split("\n")
+                line = lines.pop()[-STREAM_CHUNK_SIZE:]
+                tail.extend(lines)
+        finally:
+            process.stdout.close()
+            process.wait()
+
+    if process.returncode not in ok_codes:
+        raise CommandError(
+            command_line, process.returncode, "\n".join([*tail, line]).rstrip()
+        )
+    return written
+
+
+def _write_input(stdin, input):
+    try:
+        stdin.write(input.encode() if isinstance(input, str) else input)
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+# stands in for `from sh import <name>`, e.g: gcloud.auth.list(...), subcommands
+# are resolved when called so each call can be profiled
+@dataclass
+class Tool:
+    name: str
+    subcommands: tuple = ()
+
+    def __getattr__(self, attr):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        return Tool(self.name, self.subcommands + (attr,))
+
+    def __call__(self, *args, **kwargs):
+        tool = command(self.name)
+        for subcommand in self.subcommands:
+            tool = getattr(tool, subcommand)
+
+        with profile.phase(" ".join([self.name, *self.subcommands]), "subprocess"):
+            return tool(*args, **kwargs)
+
+    # e.g: kapp.deploy.stream("-a", app_name, "-f", "-", input=manifests)
+    def stream(self, *args, **kwargs):
+        return stream(
+            [resolve(self.name), *self.subcommands, *[str(arg) for arg in args]],
+            **kwargs,
+        )